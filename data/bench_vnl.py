@@ -0,0 +1,219 @@
+"""
+Offline benchmarks for get_vnl_data.py.
+
+The fixture pages from vnl_fixtures.py are served from a local HTTP server
+with configurable latency and error injection. The scraper's session is
+pointed at that server, so runs go through the real fetch path without
+network access. The report gives throughput and latency percentiles for
+retrieve_first_table, get_one_match_data, get_player_bio_df and main().
+
+    python bench_vnl.py --latency 0.05 --error-rate 0.02 --json bench.json
+"""
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+import get_vnl_data
+import vnl_fixtures
+import vnl_http
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Local stand-in for en.volleyballworld.com serving the fixture pages.
+    Every response is delayed by latency +/- jitter seconds and answered
+    with a 503 with probability error_rate.
+    """
+    daemon_threads = True
+
+    def __init__(self, fixture_dir=vnl_fixtures.FIXTURE_DIR, latency=0.0, jitter=0.0,
+                 error_rate=0.0, schedule_limit=None):
+        super().__init__(('127.0.0.1', 0), FixtureHandler)
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.schedule_limit = schedule_limit
+        self.requests = 0
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+    def page(self, path):
+        with self._lock:
+            if path not in self._pages:
+                self._pages[path] = vnl_fixtures.load_page(path, self.fixture_dir,
+                                                           self.schedule_limit)
+            self.requests += 1
+            return self._pages[path]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        body = server.page(unquote(self.path))
+        if random.random() < server.error_rate:
+            status, body = 503, b''
+        elif body is None:
+            status, body = 404, b''
+        else:
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Transport adapter sending requests for the real site to the local server.
+    """
+    def __init__(self, target, **kwargs):
+        super().__init__(**kwargs)
+        self.target = target
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(vnl_fixtures.SITE, self.target, 1)
+        return super().send(request, **kwargs)
+
+
+def use_server(server, pool_size=vnl_http.POOL_SIZE):
+    """
+    Point the shared session at the local server and turn the page cache off.
+    """
+    session = vnl_http.configure(pool_size=pool_size)
+    retries = session.get_adapter(vnl_fixtures.SITE).max_retries
+    session.mount(vnl_fixtures.SITE, RedirectAdapter(server.url, pool_maxsize=pool_size,
+                                                     max_retries=retries))
+    vnl_http.CACHE = None
+
+
+def summarize(name, latencies, wall):
+    """
+    Throughput and latency percentiles (in ms) of one benchmark.
+    """
+    ms = np.array(latencies) * 1000
+    return {'name': name, 'calls': len(latencies), 'wall_s': round(wall, 3),
+            'throughput_per_s': round(len(latencies) / wall, 2) if wall else None,
+            'p50_ms': round(float(np.percentile(ms, 50)), 1),
+            'p90_ms': round(float(np.percentile(ms, 90)), 1),
+            'p99_ms': round(float(np.percentile(ms, 99)), 1),
+            'max_ms': round(float(ms.max()), 1)}
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_retrieve_first_table(repeat):
+    url = vnl_fixtures.SITE + vnl_fixtures.STATS_PATH
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for table_idx in range(len(vnl_fixtures.BEST_PLAYERS)):
+            # Drop the shared parse so every call pays for fetch and parse
+            vnl_http.PAGES.clear()
+            latencies.append(timed(get_vnl_data.retrieve_first_table, url, table_idx))
+    return summarize('retrieve_first_table', latencies, time.perf_counter() - start)
+
+
+def bench_get_one_match_data(matchids):
+    latencies = []
+    start = time.perf_counter()
+    for matchid in matchids:
+        latencies.append(timed(get_vnl_data.get_one_match_data, matchid))
+    return summarize('get_one_match_data', latencies, time.perf_counter() - start)
+
+
+def bench_stage(name, func, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vnl_http.PAGES.clear()
+        latencies.append(timed(func))
+    return summarize(name, latencies, time.perf_counter() - start)
+
+
+def run(args):
+    server = FixtureServer(args.fixtures, args.latency, args.jitter, args.error_rate,
+                           schedule_limit=args.matches)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    use_server(server, args.pool_size)
+    vnl_http.set_rate_limit(args.rps)
+    get_vnl_data.MAX_WORKERS = args.workers
+    get_vnl_data.PARSE_PROCESSES = args.parse_processes
+
+    matchids = sorted(vnl_fixtures.match_rows())[:args.matches]
+    results = [bench_retrieve_first_table(args.repeat),
+               bench_get_one_match_data(matchids),
+               bench_stage('get_player_bio_df',
+                           lambda: get_vnl_data.get_player_bio_df(args.workers), args.repeat)]
+    if not args.skip_main:
+        with tempfile.TemporaryDirectory() as out_dir:
+            results.append(bench_stage('main', lambda: get_vnl_data.main(out_dir=out_dir), 1))
+    server.shutdown()
+    get_vnl_data.close_parse_pool()
+
+    print('%-22s %6s %8s %9s %8s %8s %8s %8s' % ('benchmark', 'calls', 'wall_s', 'per_s',
+                                              'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'))
+    for r in results:
+        print('%-22s %6d %8.2f %9.2f %8.1f %8.1f %8.1f %8.1f' % (
+            r['name'], r['calls'], r['wall_s'], r['throughput_per_s'],
+            r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms']))
+    print('%d requests served' % server.requests)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VNL scraper against local fixtures.')
+    parser.add_argument('--fixtures', default=vnl_fixtures.FIXTURE_DIR,
+                        help='directory of recorded pages (missing pages are synthesized)')
+    parser.add_argument('--record', action='store_true',
+                        help='record pages from the real site into --fixtures and exit')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.005, help='+/- seconds of random latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--matches', type=int, default=16, help='2021 matches to crawl')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of the 2019 benchmarks')
+    parser.add_argument('--workers', type=int, default=get_vnl_data.MAX_WORKERS)
+    parser.add_argument('--rps', type=float, default=0,
+                        help='per-host requests per second (default: no limit)')
+    parser.add_argument('--parse-processes', type=int,
+                        help='parse pages in this many worker processes')
+    parser.add_argument('--pool-size', type=int, default=vnl_http.POOL_SIZE)
+    parser.add_argument('--skip-main', action='store_true', help='do not time a full main() run')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    args = parser.parse_args()
+    if args.record:
+        vnl_fixtures.record_fixtures(args.fixtures, args.matches)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
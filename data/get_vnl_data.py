@@ -1,11 +1,16 @@
-import requests
-from bs4 import BeautifulSoup
 from lxml import etree
+import numpy as np
 import pandas as pd
 import os
-import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from vnl_aggregate import SeasonAggregates, match_summary
+from vnl_http import fetch, fetch_stream, get_page, iter_chunks, PAGES
+from vnl_metrics import count, stage, timer, write_report
+from vnl_store import CsvSink, clear_parquet, split_matchname, write_parquet, write_sqlite
 
-CURDIR = './'
 BASE_URL = 'https://en.volleyballworld.com'
 
 TEAM_TO_ABBR = {'china': 'chn', 'belgium': 'bel', 'brazil': 'bra', 
@@ -14,6 +19,72 @@ TEAM_TO_ABBR = {'china': 'chn', 'belgium': 'bel', 'brazil': 'bra',
                 'korea': 'kor', 'netherlands': 'ned', 'poland': 'pol', 
                 'russia': 'rus',  'serbia': 'srb', 'thailand': 'tha',
                 'turkey': 'tur', 'usa': 'usa'}
+MEN_TEAM_TO_ABBR = {'argentina': 'arg', 'australia': 'aus', 'brazil': 'bra',
+                    'bulgaria': 'bul', 'canada': 'can', 'china': 'chn',
+                    'france': 'fra', 'germany': 'ger', 'iran': 'iri',
+                    'italy': 'ita', 'japan': 'jpn', 'poland': 'pol',
+                    'portugal': 'por', 'russia': 'rus', 'serbia': 'srb',
+                    'usa': 'usa'}
+TEAMS = {'women': TEAM_TO_ABBR, 'men': MEN_TEAM_TO_ABBR}
+# Abbreviations of the teams of every season and gender; the teams change
+# from season to season, e.g. Argentina played the 2018 women's VNL
+TEAM_ABBRS = {**TEAM_TO_ABBR, **MEN_TEAM_TO_ABBR}
+
+# Number of match pages fetched at the same time
+MAX_WORKERS = 8
+# Worker processes that match and table pages are parsed in, so parsing is
+# not bound to one core by the GIL; None parses on the fetching threads.
+# The MAX_WORKERS fetching threads hand the raw page bytes to the processes.
+PARSE_PROCESSES = None
+# Bytes fed to the incremental parser at a time
+PARSE_CHUNK_SIZE = 16 * 1024
+
+SCHEDULE_2021_CSV = 'schedule2021.csv'
+MATCHES_2021_CSV = 'matches2021.csv'
+MATCH_SUMMARY_2021_CSV = 'match_summary2021.csv'
+# Running season totals, updated with every newly scraped match
+SEASON_AGGREGATES_2021 = 'season_aggregates2021.json'
+PLAYER_SEASON_2021_CSV = 'player_season2021.csv'
+TEAM_SEASON_2021_CSV = 'team_season2021.csv'
+
+# Points of both teams in each set; missing for sets that were not played
+SET_COLUMNS = ['set%d_%s' % (i, side) for i in range(1, 6) for side in ('home', 'away')]
+SET_TOTAL_DTYPES = {'points_home': 'int16', 'points_away': 'int16', 'sets_played': 'int8',
+                    'point_margin': 'int16'}
+
+SCHEDULE_DTYPES = {'matchid': 'int32', 'matchname': 'object', 'teamhome': 'object',
+                   'teamaway': 'object', 'scorehome': 'int8', 'awayhome': 'int8',
+                   **{col: 'Int16' for col in SET_COLUMNS}, **SET_TOTAL_DTYPES}
+
+
+def set_score_frame(scores):
+    """
+    Set score columns from an array of set scores with one row per match
+    and the columns of SET_COLUMNS (NaN for sets not played), followed by
+    the points of both teams, the number of sets played and the margin.
+    """
+    scores = np.asarray(scores, dtype='float64').reshape(-1, len(SET_COLUMNS))
+    home, away = scores[:, 0::2], scores[:, 1::2]
+    df = pd.DataFrame(scores, columns=SET_COLUMNS).astype('Int16')
+    df['points_home'] = np.nansum(home, axis=1)
+    df['points_away'] = np.nansum(away, axis=1)
+    df['sets_played'] = (~np.isnan(home)).sum(axis=1)
+    df['point_margin'] = df['points_home'] - df['points_away']
+    return df.astype(SET_TOTAL_DTYPES)
+
+
+def season_url(season, gender, path):
+    """
+    URL of a page of the 2018/2019 site, e.g. season_url(2019, 'women', 'statistics/').
+    """
+    return '%s/en/vnl/%d/%s/%s' % (BASE_URL, season, gender, path)
+
+
+def competition_url(season, path):
+    """
+    URL of a page of the competition site used since 2021.
+    """
+    return '%s/volleyball/competitions/vnl-%d/%s' % (BASE_URL, season, path)
 
 
 def format_snake(c):
@@ -31,45 +102,163 @@ def create_unique_strings(org_l):
     Add prefix to the string if the strings in the the list are duplicates.
     """
     l = []
+    seen = set()
+    # Next prefix number to try for each duplicated name
+    next_count = {}
     for name in org_l:
-        if name not in l:
+        if name not in seen:
             l.append(name)
+            seen.add(name)
             continue
-        count = 0
-        while  str(count) + '/' + name in l:
+        count = next_count.get(name, 0)
+        while  str(count) + '/' + name in seen:
             count += 1
+        next_count[name] = count + 1
         l.append(str(count) + '/' + name)
+        seen.add(l[-1])
     return l
 
 
-def save_csv(df, filename):
+def save_csv(df, filename, out_dir='./', parquet_dir=None, season=2019, gender='women',
+             sqlite_db=None):
     """
-    Save the dataframe as a csv file.
+    Save the dataframe as a csv file in out_dir, as a Parquet dataset
+    partitioned by season and gender under parquet_dir if it is set, and
+    into the sqlite store sqlite_db if it is set.
     """
-    fname = os.path.join(CURDIR, filename)
+    fname = os.path.join(out_dir, filename)
     df.to_csv(fname, index=False)
+    count('rows', len(df))
     print(fname + ' saved.')
+    if parquet_dir is not None:
+        dataset = os.path.splitext(filename)[0]
+        clear_parquet(parquet_dir, dataset)
+        write_parquet(df.assign(season=season, gender=gender), parquet_dir, dataset,
+                      ['season', 'gender'], PARQUET_DTYPES[dataset])
+    if sqlite_db is not None:
+        save_sqlite(df.assign(season=season, gender=gender), sqlite_db,
+                    os.path.splitext(filename)[0])
     return True
 
 
+def save_sqlite(df, sqlite_db, dataset):
+    """
+    Upsert the rows of df into the table of dataset in the sqlite store.
+    """
+    keys, indexes = SQLITE_TABLES[dataset]
+    with timer('sqlite'):
+        write_sqlite(df, sqlite_db, dataset.replace('-', '_'), keys, indexes)
+
+
+def parse_content(content, encoding=None):
+    """
+    Parse raw page bytes into an lxml tree.
+    """
+    parser = etree.HTMLParser(encoding=encoding)
+    return etree.fromstring(content, parser)
+
+
+def parse_tree(response):
+    """
+    Parse the raw bytes of a response into an lxml tree.
+    """
+    with timer('parse'):
+        return parse_content(response.content, response.encoding)
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """
+    The shared pool of PARSE_PROCESSES parse workers, or None.
+    The workers are forked as soon as the pool is created, so create it
+    before the fetching threads start, as main() does.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None and PARSE_PROCESSES:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES)
+            # Start every worker now rather than on the first parse job
+            for future in [_parse_pool.submit(os.getpid) for _ in range(PARSE_PROCESSES)]:
+                future.result()
+        return _parse_pool
+
+
+def close_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown()
+            _parse_pool = None
+
+
+def element_text(element):
+    """
+    Text of an element and all its descendants, like BeautifulSoup's .text.
+    """
+    return ''.join(element.itertext())
+
+
 def retrieve_first_table(url, table_idx=0, header_span=False, th_row=0, 
                          prefix_col=0, override_column=None, td_span=False):
   """
   Scrape the first table on the page at url.
   """
-  data = requests.get(url).text
-  soup = BeautifulSoup(data, "lxml")
+  table = dict(table_idx=table_idx, header_span=header_span, th_row=th_row,
+               prefix_col=prefix_col, override_column=override_column, td_span=td_span)
+  return retrieve_tables(url, [table])[0]
+
+
+def retrieve_tables(url, tables):
+  """
+  Scrape several tables of the page at url, one per dict of
+  retrieve_first_table arguments in tables. The page is parsed once, and
+  the tables of a (url, tables) pair are extracted once per run, so pass
+  the same list from every function that needs tables of one page.
+  """
+  key = (url, 'tables', repr(tables))
+  dfs = []
+  for colnames, data_cols in PAGES.memo(key, lambda: _page_tables(url, tables)):
+    with timer('dataframe'):
+      dfs.append(pd.DataFrame(dict(zip(colnames, data_cols)), columns=colnames, dtype=object))
+  return dfs
+
+
+def _page_tables(url, tables):
+  pool = get_parse_pool()
+  if pool is None:
+    tree = get_page(url, parse_tree)
+    with timer('parse'):
+      return [_table_columns(tree, **table) for table in tables]
+  html = PAGES.fetch(url)
+  with timer('parse'):
+    return pool.submit(table_page_columns, html.content, html.encoding, tables).result()
+
+
+def table_page_columns(content, encoding, tables):
+  """
+  Column names and data of several tables of a page given as raw bytes.
+  Runs in the parse worker processes.
+  """
+  tree = parse_content(content, encoding)
+  return [_table_columns(tree, **table) for table in tables]
 
+
+def _table_columns(tree, table_idx=0, header_span=False, th_row=0, prefix_col=0,
+                   override_column=None, td_span=False):
   # Retrive table
-  table = soup.find_all("table")[table_idx]
+  table = list(tree.iter("table"))[table_idx]
   
   # Find column names
   if override_column is None:
-    header = table.thead.find_all('tr')[th_row].find_all('th')
+    thead = next(table.iterdescendants('thead'))
+    header = list(list(thead.iterdescendants('tr'))[th_row].iterdescendants('th'))
     if header_span:
-      colnames = [th.find_all('span')[0].text for th in header]
+      colnames = [element_text(next(th.iterdescendants('span'))) for th in header]
     else:
-      colnames = [th.text for th in header]
+      colnames = [element_text(th) for th in header]
     colnames = ['']*prefix_col + colnames
     # Change column names into snake format
     colnames = [format_snake(c) for c in colnames]
@@ -78,73 +267,143 @@ def retrieve_first_table(url, table_idx=0, header_span=False, th_row=0,
   else:
     colnames = override_column
   
-  df = pd.DataFrame(columns=colnames)
-
-  # Collecte table data
-  for tr in table.tbody.find_all('tr'):    
+  # Collect table data column by column and build the frame once
+  data_cols = [[] for _ in colnames]
+  tbody = next(table.iterdescendants('tbody'))
+  for tr in tbody.iterdescendants('tr'):    
       # Find all data for each column
-      columns = tr.find_all('td')
+      columns = list(tr.iterdescendants('td'))
       if columns == []:
         continue
-      if td_span:
-        row_dict = {}
-        for i in range(len(columns)):
-          spans = columns[i].find_all('span')
-          if spans:
-            value = '-'.join([span.text.strip() for span in spans])
-          else:
-            value = columns[i].text.strip()
-          row_dict[colnames[i]] = value
-      else:
-          row_dict = {colnames[i]: columns[i].text.strip() for i in range(len(columns))}
-      df = df.append(row_dict, ignore_index=True)
-  return df
-
-
-def get_match_summary():
+      for i in range(len(colnames)):
+        if i >= len(columns):
+          data_cols[i].append(np.nan)
+          continue
+        spans = list(columns[i].iterdescendants('span')) if td_span else []
+        if spans:
+          value = '-'.join([element_text(span).strip() for span in spans])
+        else:
+          value = element_text(columns[i]).strip()
+        data_cols[i].append(value)
+  return colnames, data_cols
+
+
+# The team ranking and match result tables of the round1 page, retrieved
+# together so the page is parsed once for both
+ROUND1_TABLES = [
+    dict(header_span=False, th_row=1, prefix_col=3),
+    dict(override_column=['number', 'date', 'teams', 'sets', 'set1_point', 'set2_point',
+                          'set3_point', 'set4_point', 'set5_point',
+                          'pionts', 'time', 'audience'], td_span=True, table_idx=1),
+]
+
+
+def get_match_summary(season=2019, gender='women'):
     """
     Get the match summary for the round robin.
     """
-    match_summary_url = "https://en.volleyballworld.com/en/vnl/2019/women/resultsandranking/round1"
-    colnames = ['number', 'date', 'teams', 'sets', 'set1_point', 'set2_point', 
-                'set3_point', 'set4_point', 'set5_point', 
-                'pionts', 'time', 'audience']
-    match_summary_df = retrieve_first_table(match_summary_url, override_column=colnames, td_span=True, table_idx=1)
-    for i in range(1, 6):
-        # Clean the set point columns
-        match_summary_df['set%s_point' % i] = match_summary_df['set%s_point' % i]\
-            .apply(lambda x: (x[:2] if x[1].isnumeric() else x[0]) + '-' + 
-                (x[-2:] if x[-2].isnumeric() else x[-1]) if x!='-' else x)
-    return match_summary_df
-
-
-def save_best_players():
+    match_summary_url = season_url(season, gender, 'resultsandranking/round1')
+    match_summary_df = retrieve_tables(match_summary_url, ROUND1_TABLES)[1]
+    # Set points read like '23-25', or '-' for sets that were not played
+    point_cols = ['set%d_point' % i for i in range(1, 6)]
+    scores = pd.concat([match_summary_df[col].str.extract(r'^(\d{1,2})\D.*?(\d{1,2})$')
+                        for col in point_cols], axis=1)
+    scores = scores.apply(pd.to_numeric, errors='coerce').to_numpy()
+    sets = set_score_frame(scores)
+    sets.index = match_summary_df.index
+    at = match_summary_df.columns.get_loc('set1_point')
+    match_summary_df = match_summary_df.drop(columns=point_cols)
+    return pd.concat([match_summary_df.iloc[:, :at], sets[SET_COLUMNS],
+                      match_summary_df.iloc[:, at:], sets.drop(columns=SET_COLUMNS)], axis=1)
+
+
+BEST_PLAYERS = ['best-scorers', 'best-spikers', 'best-blockers', 'best-servers',
+                'best-setters', 'best-diggers', 'best-receivers']
+
+# Natural keys and indexed columns of every dataset in the sqlite store
+SQLITE_TABLES = {
+    'player_bio': (['season', 'gender', 'team', 'name'], [['team'], ['name']]),
+    'team_rank': (['season', 'gender', 'team'], [['team']]),
+    'round_robin': (['season', 'gender', 'number'], [['teams']]),
+    'schedule': (['matchid'], [['teamhome'], ['teamaway']]),
+    'matches': (['schedule_id', 'nationality', 'number'], [['nationality'], ['name']]),
+    'match_summary': (['schedule_id', 'team'], [['team'], ['opponent']]),
+}
+SQLITE_TABLES.update({name: (['season', 'gender', 'team', 'shirtnumber'], [['team'], ['name']])
+                      for name in BEST_PLAYERS})
+
+# Column types of the Parquet datasets of the 2019 tables, which are scraped
+# as text; ratios and rates are floats and the other numbers counts
+BEST_PLAYER_STATS = {
+    'best-scorers': ['attacks', 'blocks', 'serves', 'total'],
+    'best-spikers': ['spikes', 'faults', 'shots', 'total_attempts', 'success_%'],
+    'best-blockers': ['stuff_blocks', 'faults', 'rebounds', 'total_attempts', 'average_per_set'],
+    'best-servers': ['aces', 'faults', 'hits', 'total_attempts', 'average_per_set'],
+    'best-setters': ['running_sets', 'faults', 'still_sets', 'total_attempts', 'average_per_set'],
+    'best-diggers': ['digs', 'faults', 'receptions', 'total_attempts', 'average_per_set'],
+    'best-receivers': ['excellents', 'faults', 'serve_receptions', 'total_attempts', 'efficiency_%'],
+}
+RATE_COLUMNS = {'success_%', 'average_per_set', 'efficiency_%', 'set_ratio', 'point_ratio'}
+PARQUET_DTYPES = {
+    'player_bio': {'name': 'object', 'birthdate': 'object',
+                   **{col: 'Int16' for col in ['height', 'weight', 'spike', 'block',
+                                               'world_championships', 'olympic_games',
+                                               'other', 'total']},
+                   'club': 'object', 'team': 'object', 'position': 'object'},
+    'team_rank': {'rank': 'int8', 'team_full': 'object',
+                  **{col: 'float64' if col in RATE_COLUMNS else 'int16' for col in
+                     ['match_total', 'match_win', 'match_lose', '3-0', '3-1', '3-2', '2-3',
+                      '1-3', '0-3', 'points', 'set_won', 'set_lost', 'set_ratio',
+                      'point_won', 'point_lost', 'point_ratio']},
+                  'team': 'object'},
+    'round_robin': {'number': 'int16', 'date': 'object', 'teams': 'object', 'sets': 'object',
+                    **{col: 'Int16' for col in SET_COLUMNS},
+                    'pionts': 'object', 'time': 'object', 'audience': 'int32',
+                    **SET_TOTAL_DTYPES},
+}
+PARQUET_DTYPES.update({name: {'rank': 'int16', 'shirtnumber': 'int8', 'name': 'object',
+                              'team': 'object',
+                              **{col: 'float64' if col in RATE_COLUMNS else 'int16'
+                                 for col in stats}}
+                       for name, stats in BEST_PLAYER_STATS.items()})
+
+
+def get_best_players(season=2019, gender='women'):
     """
-    Save 7 csv files for the best player data.
+    Get the 7 best player tables as a list of (name, dataframe).
     """
-    positions = ['best-scorers', 'best-spikers', 'best-blockers', 'best-servers', 'best-setters', 'best-diggers', 'best-receivers']
-    base_url_best_players = "https://en.volleyballworld.com/en/vnl/2019/women/statistics/"
+    base_url_best_players = season_url(season, gender, 'statistics/')
 
-    for i in range(7):
-        df = retrieve_first_table(base_url_best_players, table_idx=i, header_span=False)
+    tables = []
+    dfs = retrieve_tables(base_url_best_players,
+                          [dict(table_idx=i, header_span=False) for i in range(len(BEST_PLAYERS))])
+    for i, df in enumerate(dfs):
         # Drop the last row
         print(df.tail(1))
         df.drop(df.tail(1).index,inplace=True)
         # Insert a rank column
         df['rank'] = list(range(1, len(df)+1))
-        save_csv(df, positions[i] + '.csv')
+        tables.append((BEST_PLAYERS[i], df))
+    return tables
+
+
+def save_best_players(out_dir='./', parquet_dir=None, sqlite_db=None):
+    """
+    Save 7 csv files for the best player data.
+    """
+    for name, df in get_best_players():
+        save_csv(df, name + '.csv', out_dir, parquet_dir, sqlite_db=sqlite_db)
         
     return df
 
 
-def get_team_rank_with_match():
+def get_team_rank_with_match(season=2019, gender='women'):
     """
     Save the team rank csv file.
     """
     # Scrape table from the webpage
-    team_rank_match_url = 'https://en.volleyballworld.com/en/vnl/2019/women/resultsandranking/round1'
-    team_rank_match_df = retrieve_first_table(team_rank_match_url, 
-                                            header_span=False, th_row=1, prefix_col=3)
+    team_rank_match_url = season_url(season, gender, 'resultsandranking/round1')
+    team_rank_match_df = retrieve_tables(team_rank_match_url, ROUND1_TABLES)[0]
     # Drop empty column
     team_rank_match_df.drop(team_rank_match_df.columns[2], axis=1, inplace=True)
 
@@ -161,90 +420,130 @@ def get_team_rank_with_match():
     colnames[-4] = 'set_ratio'
     team_rank_match_df.columns = colnames
 
-    # Insert column for team abbreviation
-    team_rank_match_df['team'] = team_rank_match_df['team_full'].apply(lambda x: TEAM_TO_ABBR[x.lower()].upper())
+    # Insert column for team abbreviation, missing for unknown teams
+    team_rank_match_df['team'] = team_rank_match_df['team_full'].str.lower().map(TEAM_ABBRS).str.upper()
 
     return team_rank_match_df
 
-def get_player_bio_df():
-    """
-    Save player bio into a csv file.
-    """
-    player_all_df = pd.DataFrame()
-    for team in TEAM_TO_ABBR:
-        abbr = TEAM_TO_ABBR[team]
-        link_part = '%s-%s' % (abbr, team)
-        player_url = "https://en.volleyballworld.com/en/vnl/2019/women/teams/%s/team_roster" % link_part
-        player_df = retrieve_first_table(player_url, header_span=False)
-        # Drop index
-        player_df.drop(player_df.columns[0], axis=1, inplace=True)
-        # Insert a team column
-        player_df['team'] = abbr.upper()
-        player_all_df = pd.concat([player_all_df, player_df])
-
-    return player_all_df
-
-
 def get_position(url):
     """
     Get info about player position from url.
+    Only the page up to the end of the first div.col-1-3 is parsed.
     """
-    data = requests.get(url).text
-    soup = BeautifulSoup(data, "lxml")
-    position = soup.find_all("div", class_='col-1-3')[0].find_all('li')[0].find_all('span')[1].text.strip()
-    return position
+    html = fetch(url)
+    parser = etree.HTMLPullParser(events=('end',), tag='div', encoding=html.encoding)
+    with timer('parse'):
+        for chunk in iter_chunks(html.content, PARSE_CHUNK_SIZE):
+            parser.feed(chunk)
+            for _, div in parser.read_events():
+                if 'col-1-3' in div.get('class', '').split():
+                    li = next(div.iterdescendants('li'))
+                    span = list(li.iterdescendants('span'))[1]
+                    return element_text(span).strip()
+    raise IndexError('no div.col-1-3 on %s' % url)
 
 
 def get_player_href(url):
     """
     Get the list of links for each player page.
     """
-    data = requests.get(url).text
-    soup = BeautifulSoup(data, "lxml")
-    table = soup.find_all('table')[0]
-    a_s = table.find_all('a', href=True)
-    hrefs = [BASE_URL + a.get('href') for a in a_s]
+    tree = get_page(url, parse_tree)
+    table = next(tree.iter('table'))
+    hrefs = [BASE_URL + a.get('href') for a in table.iterdescendants('a')
+             if a.get('href') is not None]
     return hrefs
 
 
-def get_player_bio_df():
+def get_team_roster(team, season=2019, gender='women'):
     """
-    Save player bio into a csv file.
+    Get the roster table of a team and the links to its player pages.
     """
-    player_all_df = pd.DataFrame()
-    for team in TEAM_TO_ABBR:
-        abbr = TEAM_TO_ABBR[team]
-        link_part = '%s-%s' % (abbr, team)
-
-        team_url = "https://en.volleyballworld.com/en/vnl/2019/women/teams/%s/team_roster" % link_part
-        player_df = retrieve_first_table(team_url, header_span=False)
-        # Drop index
-        player_df.drop(player_df.columns[0], axis=1, inplace=True)
-        # Insert a team column
-        player_df['team'] = abbr.upper()
+    if team not in TEAM_ABBRS:
+        raise ValueError('no abbreviation for team %r' % team)
+    abbr = TEAM_ABBRS[team]
+    link_part = '%s-%s' % (abbr, team)
 
-        # Get player position
-        player_links = get_player_href(team_url)
-        positions = [get_position(url) for url in player_links]
-        player_df['position'] = positions
+    team_url = season_url(season, gender, 'teams/%s/team_roster' % link_part)
+    player_df = retrieve_first_table(team_url, header_span=False)
+    # Drop index
+    player_df.drop(player_df.columns[0], axis=1, inplace=True)
+    # Insert a team column
+    player_df['team'] = abbr.upper()
+    return player_df, get_player_href(team_url)
 
-        player_all_df = pd.concat([player_all_df, player_df])
 
+def get_player_bio_df(max_workers=None, season=2019, gender='women'):
+    """
+    Save player bio into a csv file.
+    Rosters and player pages share one pool of max_workers threads (default
+    MAX_WORKERS); the player pages of a team are queued as soon as its
+    roster arrives. Rows keep the team order of TEAMS[gender] and the roster
+    order.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    teams = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rosters = executor.map(lambda team: get_team_roster(team, season, gender), TEAMS[gender])
+        for player_df, player_links in rosters:
+            # Get player position
+            positions = [executor.submit(get_position, url) for url in player_links]
+            teams.append((player_df, positions))
+        for player_df, positions in teams:
+            player_df['position'] = [future.result() for future in positions]
+
+    player_all_df = pd.concat([player_df for player_df, _ in teams])
     return player_all_df
 
 
-
-def get_vnl_schedule_2021()
+def get_schedule(season=2021):
+    """
+    Get the schedule and overall result of the finished matches of a season.
+    """
+    url = competition_url(season, 'schedule/')
+    html = fetch(url)
+    selector = parse_tree(html)
+    with timer('parse'):
+        infoslist = _schedule_rows(selector)
+    titlelist =['matchid','matchname','teamhome','teamaway','scorehome','awayhome']
+    with timer('dataframe'):
+        schedule = _schedule_df(infoslist, titlelist)
+    return schedule
+
+
+def get_vnl_schedule_2021(out_dir='./', parquet_dir=None, sqlite_db=None):
     """ 
     Query for the 2021 match schedule and overall result.
     """
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0',}
-    url = 'https://en.volleyballworld.com/volleyball/competitions/vnl-2021/schedule/'
-    html = requests.get(url,headers = headers)
-    selector = etree.HTML(html.text)
+    schedule = get_schedule(2021)
+    count('rows', len(schedule))
+    matchid_list = list(schedule['matchid'])
+    schedule.to_csv(os.path.join(out_dir, SCHEDULE_2021_CSV), index=False)
+    if parquet_dir is not None:
+        schedule['season'] = 2021
+        schedule['gender'], schedule['stage'] = split_matchname(schedule['matchname'])
+        clear_parquet(parquet_dir, 'schedule')
+        write_parquet(schedule, parquet_dir, 'schedule', ['season', 'gender', 'stage'],
+                      SCHEDULE_DTYPES)
+    if sqlite_db is not None:
+        save_sqlite(schedule[list(SCHEDULE_DTYPES)].astype(SCHEDULE_DTYPES), sqlite_db, 'schedule')
+    return matchid_list
+
+
+def read_matchids_2021(out_dir='./'):
+    """
+    Match IDs of the schedule2021.csv stored in out_dir; the schedule is
+    fetched and saved first if there is none yet.
+    """
+    fname = os.path.join(out_dir, SCHEDULE_2021_CSV)
+    if not os.path.exists(fname):
+        return get_vnl_schedule_2021(out_dir)
+    return list(pd.read_csv(fname, usecols=['matchid'], dtype=str)['matchid'])
+
+
+def _schedule_rows(selector):
     infos = selector.xpath("//div[@class='vbw-mu--match vbw-mu-finished vbw-mu']")#/a/div/div[@class='vbw-mu__info--details']/text()
     infoslist = []
-    titlelist =['matchid','matchname','teamhome','teamaway','scorehome','awayhome','result']
     for info in infos:
         matchid = info.xpath("@matchid")[0][-5:]
         matchname = info.xpath("a/div/div[@class='vbw-mu__info--details']/text()")[0]
@@ -262,186 +561,447 @@ def get_vnl_schedule_2021()
         infolist.append(awayhome)
         infolist.append(result)
         infoslist.append(infolist)
-    schedule = pd.DataFrame(infoslist,columns=titlelist)    
-    matchid_list = list(schedule['matchid'])
-    schedule["result"] = schedule["result"].apply(lambda x: x.replace("'", ""))
-    schedule["result"] = schedule["result"].apply(lambda x: x[1:-1].split(',')) #
-    schedule["result"] = schedule["result"].apply(lambda x: [int(i.strip()) for i in x if i != ' -'])
-    schedule["points_home"] = schedule["result"].apply(lambda x: sum([x[i] for i in range(len(x)) if i % 2 == 0]))
-    schedule["points_away"] = schedule["result"].apply(lambda x: sum([x[i] for i in range(len(x)) if i % 2 == 1]))
-    schedule.to_csv('schedule2021.csv', index=False)
-    return matchid_list
+    return infoslist
+
+
+def _schedule_df(infoslist, titlelist):
+    schedule = pd.DataFrame([info[:-1] for info in infoslist], columns=titlelist)
+    # Played sets read home, '-', away; drop the separators and pad the
+    # sets that were not played
+    width = len(SET_COLUMNS)
+    spans = [([span for span in info[-1] if span.strip() != '-'] + [''] * width)[:width]
+             for info in infoslist]
+    scores = pd.to_numeric(pd.Series(np.ravel(spans), dtype=object).str.strip(), errors='coerce')
+    return pd.concat([schedule, set_score_frame(scores.to_numpy())], axis=1)
+
+# Stat tables on a finished match page, in output column order. Each entry is
+# (table kind, player row class, [(cell class, output column), ...]); cells
+# are the <td class="vbw-o-table__cell <cell class>"> of each player row.
+MATCH_TABLES = [
+    ('scoring', 'vbw-o-table__row vbw-o-table__row--scoring vbw-stats-player',
+     [('shirtnumber', 'number'), ('playername', 'name'), ('position', 'position'),
+      ('attacks', 'attackpoints'), ('blocks', 'blockpoints'), ('serves', 'servepoints'),
+      ('efficiency-percentage', 'efficency'), ('total-abs', 'totalabs')]),
+    ('attack', 'vbw-o-table__row vbw-o-table__row--scoring vbw-stats-player',
+     [('point', 'attack_pt'), ('errors', 'attack_err'), ('attempts', 'attack_att'),
+      ('total', 'attack_tot'), ('efficiency-percentage', 'attack_eff')]),
+    ('block', 'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player',
+     [('point', 'block_pt'), ('errors', 'block_err'), ('touches', 'block_touches'),
+      ('total', 'block_tot'), ('efficiency-percentage', 'block_eff')]),
+    ('serve', 'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player',
+     [('point', 'serve_pt'), ('errors', 'serve_err'), ('attempts', 'serve_attempts'),
+      ('total', 'serve_tot'), ('efficiency-percentage', 'serve_eff')]),
+    ('reception', 'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player',
+     [('successful', 'reception_successful'), ('errors', 'reception_err'),
+      ('attempts', 'reception_attempts'), ('total', 'reception_tot'),
+      ('efficiency-percentage', 'reception_eff')]),
+    ('dig', 'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player',
+     [('digs', 'dig_digs'), ('errors', 'dig_err'), ('attempts', 'dig_tot'), ('total', 'dig_eff')]),
+    ('set', 'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player',
+     [('successful', 'set_pt'), ('errors', 'set_err'), ('attempts', 'set_attempts'),
+      ('total', 'set_tot'), ('efficiency-percentage', 'set_eff')]),
+]
+MATCH_COLUMNS = ['schedule_id', 'nationality'] + \
+    [col for _, _, cells in MATCH_TABLES for _, col in cells]
+# Efficiency cells are left empty when a player has no attempts
+MATCH_OPTIONAL_COLUMNS = {'efficency', 'attack_eff', 'block_eff', 'serve_eff',
+                          'reception_eff', 'dig_eff', 'set_eff'}
+# Column types of the match data: efficiencies are floats (NaN if missing)
+# and every column not listed here is a count
+MATCH_DTYPES = {col: 'int16' for col in MATCH_COLUMNS}
+MATCH_DTYPES.update({col: 'float64' for col in MATCH_OPTIONAL_COLUMNS})
+MATCH_DTYPES.update({'schedule_id': 'int32', 'nationality': 'category',
+                     'name': 'object', 'position': 'category'})
+
+# Ancestors of the team links on a finished match page, nearest first
+_MATCH_TEAM_LINK_PATH = ['li', 'ul'] + ['div'] * 7 + ['section']
+_MATCH_TEAM_ABBR = etree.XPath("div[@class = 'vbw-mu__team__name vbw-mu__team__name--abbr']/text()")
+_TEXT = etree.XPath("text()")
+
+
+def _cell_texts(tr):
+    """
+    Map each cell class of a table row to the first text node of the cell.
+    """
+    cells = {}
+    for td in tr.iterchildren('td'):
+        cls = td.get('class')
+        if cls in cells:
+            continue
+        if td.text is not None:
+            cells[cls] = td.text
+        else:
+            texts = _TEXT(td)
+            if texts:
+                cells[cls] = texts[0]
+    return cells
+
 
-def get_one_match_data(matchid):
+def _pull_events(chunks, tags, encoding=None):
     """
-    Query for one match given the ID.
+    Feed chunks of raw page bytes to an incremental HTML parser and yield
+    its (event, element) pairs for the given tags as they come.
+    """
+    parser = etree.HTMLPullParser(events=('start', 'end'), tag=tags, encoding=encoding)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def extract_match_columns(chunks, matchid, encoding=None):
     """
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0',}
-    url ='https://en.volleyballworld.com/volleyball/competitions/vnl-2021/schedule/' + matchid + '/_libraries/_finished-match'
-          
-    html = requests.get(url,headers = headers)
-    selector = etree.HTML(html.text)
-    nationinfos = selector.xpath("//section/div/div/div/div/div/div/div/ul/li/a")
+    Extract the stats of every player on a finished match page, given as
+    chunks of raw bytes, as a dict of typed column arrays, one entry per
+    player.
+
+    The page is parsed incrementally: a player row is read as soon as its
+    <tr> closes, and every element that has been read is dropped from the
+    tree, so only the open elements and the current row are in memory.
+    """
+    table_classes = ['vbw-o-table vbw-match-player-statistic-table vbw-stats-%s vbw-set-all' % kind
+                     for kind, _, _ in MATCH_TABLES]
     dicinfo = {}
-    for nationinfo in nationinfos:
-        team = nationinfo.xpath('./@href')[0][1:]
-        nation = nationinfo.xpath("./div[@class = 'vbw-mu__team__name vbw-mu__team__name--abbr']/text()")[0]
-        dicinfo[team] = nation
-    infoteam = selector.xpath("//table[contains(@class,'vbw-o-table vbw-match-player-statistic-table vbw-stats-scoring vbw-set-all')]")                                                 
+    teams = []
+    # team -> cell texts of the player rows of every stat table
+    team_rows = {}
+    # open stat table -> (team, table number)
+    tables = {}
+    # open <tr> and <a> elements, whose children are still needed
+    open_rows = 0
+    for event, element in _pull_events(chunks, ('table', 'tr', 'a'), encoding):
+        tag = element.tag
+        if event == 'start':
+            if tag in ('tr', 'a'):
+                open_rows += 1
+            elif tag == 'table':
+                cls = element.get('class')
+                team = element.get('data-team')
+                if cls is None or team is None:
+                    continue
+                for k, table_class in enumerate(table_classes):
+                    if table_class in cls:
+                        break
+                else:
+                    continue
+                if team not in team_rows:
+                    team_rows[team] = [[] for _ in MATCH_TABLES]
+                # Teams come in the order of their scoring tables
+                if k == 0 and team not in teams:
+                    teams.append(team)
+                tables[element] = (team, k)
+            continue
 
-    df = pd.DataFrame()                   
-    infoslist = []
-    titlelist =['schedule_id','nationality','number','name','position','attackpoints','blockpoints','servepoints','efficency',
-                'totalabs','attack_pt','attack_err','attack_att','attack_tot','attack_eff','block_pt','block_err','block_touches','block_tot','block_eff',
-    'serve_pt','serve_err','serve_attempts','serve_tot','serve_eff','reception_successful','reception_err',
-    'reception_attempts','reception_tot','reception_eff','dig_digs','dig_err','dig_tot','dig_eff',
-    'set_pt','set_err','set_attempts','set_tot','set_eff'] #'schedule_id','playerid','nationality','birthday','height','weight',
-    
-    
-    for j in range(len(infoteam)):
-        pageteam =     infoteam[j].xpath('./@data-team')[0]
-        infos0 = selector.xpath("//table[contains(@class,'vbw-o-table vbw-match-player-statistic-table vbw-stats-scoring vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--scoring vbw-stats-player')]".format(pageteam))
-        infos1 = selector.xpath("//table[contains(@class,'vbw-o-table vbw-match-player-statistic-table vbw-stats-attack vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--scoring vbw-stats-player')]".format(pageteam))
-        infos2 = selector.xpath("//table[contains(@class, 'vbw-o-table vbw-match-player-statistic-table vbw-stats-block vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player')]".format(pageteam))
-        infos3 = selector.xpath("//table[contains(@class, 'vbw-o-table vbw-match-player-statistic-table vbw-stats-serve vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player')]".format(pageteam))
-        infos4 = selector.xpath("//table[contains(@class, 'vbw-o-table vbw-match-player-statistic-table vbw-stats-reception vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player')]".format(pageteam))
-        infos5 = selector.xpath("//table[contains(@class, 'vbw-o-table vbw-match-player-statistic-table vbw-stats-dig vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player')]".format(pageteam))
-        infos6 = selector.xpath("//table[contains(@class, 'vbw-o-table vbw-match-player-statistic-table vbw-stats-set vbw-set-all') and @data-team = '{}']/tbody/tr[contains(@class,'vbw-o-table__row vbw-o-table__row--attack vbw-stats-player')]".format(pageteam))
-        for i in range(len(infos0)):
-            # print(i,matchid)
-            schedule_id = matchid
-            nationality =  dicinfo[pageteam]
-            number =       infos0[i].xpath("td[@class='vbw-o-table__cell shirtnumber']/text()")[0]
-            name =         infos0[i].xpath("td[@class='vbw-o-table__cell playername']/text()")[0]
-            position =     infos0[i].xpath("td[@class='vbw-o-table__cell position']/text()")[0]
-            attackpoints = infos0[i].xpath("td[@class='vbw-o-table__cell attacks']/text()")[0]
-            blockpoints =  infos0[i].xpath("td[@class='vbw-o-table__cell blocks']/text()")[0]
-            servepoints =  infos0[i].xpath("td[@class='vbw-o-table__cell serves']/text()")[0]
-            efficency =    infos0[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if efficency == []:
-                efficency = [' ']
-            efficency = efficency[0]    
-            totalabs = infos0[i].xpath("td[@class='vbw-o-table__cell total-abs']/text()")[0]
-            attack_pt =  infos1[i].xpath("td[@class='vbw-o-table__cell point']/text()")[0]
-            attack_err = infos1[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0]
-            attack_att = infos1[i].xpath("td[@class='vbw-o-table__cell attempts']/text()")[0]
-            attack_tot = infos1[i].xpath("td[@class='vbw-o-table__cell total']/text()")[0]
-            attack_eff = infos1[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if attack_eff == []:
-                attack_eff = [' ']
-            attack_eff = attack_eff[0]
-            block_pt = infos2[i].xpath("td[@class='vbw-o-table__cell point']/text()")[0]
-            block_err = infos2[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0] 
-            block_touches = infos2[i].xpath("td[@class='vbw-o-table__cell touches']/text()")[0]
-            block_tot = infos2[i].xpath("td[@class='vbw-o-table__cell total']/text()")[0]
-            block_eff = infos2[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if block_eff == []:
-                block_eff = [' ']
-            block_eff = block_eff[0]
-            serve_pt = infos3[i].xpath("td[@class='vbw-o-table__cell point']/text()")[0]
-            serve_err = infos3[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0]  
-            serve_attempts = infos3[i].xpath("td[@class='vbw-o-table__cell attempts']/text()")[0]
-            serve_tot = infos3[i].xpath("td[@class='vbw-o-table__cell total']/text()")[0]
-            serve_eff = infos3[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if serve_eff == []:
-                serve_eff = [' ']
-            serve_eff = serve_eff[0]    
-            reception_successful = infos4[i].xpath("td[@class='vbw-o-table__cell successful']/text()")[0]
-            reception_err = infos4[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0]      
-            reception_attempts = infos4[i].xpath("td[@class='vbw-o-table__cell attempts']/text()")[0]
-            reception_tot = infos4[i].xpath("td[@class='vbw-o-table__cell total']/text()")[0]
-            reception_eff = infos4[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if reception_eff == []:
-                reception_eff = [' ']
-            reception_eff = reception_eff[0]    
-            dig_digs = infos5[i].xpath("td[@class='vbw-o-table__cell digs']/text()")[0]
-            dig_err = infos5[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0] 
-            dig_tot = infos5[i].xpath("td[@class='vbw-o-table__cell attempts']/text()")[0]
-            dig_eff = infos5[i].xpath("td[@class='vbw-o-table__cell total']/text()")
-            if dig_eff == []:
-                dig_eff = [' ']
-            dig_eff = dig_eff[0]    
-            set_pt = infos6[i].xpath("td[@class='vbw-o-table__cell successful']/text()")[0]
-            set_err = infos6[i].xpath("td[@class='vbw-o-table__cell errors']/text()")[0]  
-            set_attempts = infos6[i].xpath("td[@class='vbw-o-table__cell attempts']/text()")[0]
-            set_tot = infos6[i].xpath("td[@class='vbw-o-table__cell total']/text()")[0]
-            set_eff = infos6[i].xpath("td[@class='vbw-o-table__cell efficiency-percentage']/text()")
-            if set_eff == []:
-                set_eff = [' ']
-            set_eff = set_eff[0]   
-            infolist = []
-            infolist.append(schedule_id)
-            infolist.append(nationality)
-            infolist.append(number)
-            infolist.append(name)
-            infolist.append(position)
-            infolist.append(attackpoints)
-            infolist.append(blockpoints)
-            infolist.append(servepoints)
-            infolist.append(efficency)
-            infolist.append(totalabs)
-            infolist.append(attack_pt)
-            infolist.append(attack_err)
-            infolist.append(attack_att)
-            infolist.append(attack_tot)
-            infolist.append(attack_eff)
-            infolist.append(block_pt)
-            infolist.append(block_err)
-            infolist.append(block_touches)
-            infolist.append(block_tot)
-            infolist.append(block_eff)
-            infolist.append(serve_pt)
-            infolist.append(serve_err)
-            infolist.append(serve_attempts)
-            infolist.append(serve_tot)
-            infolist.append(serve_eff)
-            infolist.append(reception_successful)
-            infolist.append(reception_err)
-            infolist.append(reception_attempts)
-            infolist.append(reception_tot)
-            infolist.append(reception_eff)
-            infolist.append(dig_digs)
-            infolist.append(dig_err)
-            infolist.append(dig_tot)
-            infolist.append(dig_eff)
-            infolist.append(set_pt)
-            infolist.append(set_err)
-            infolist.append(set_attempts)
-            infolist.append(set_tot)
-            infolist.append(set_eff)
-            infoslist.append(infolist)
-            time.sleep(0.5)
-            # print(name,nationality,number)
-    df = pd.DataFrame(infoslist,columns=titlelist)
+        if tag == 'a':
+            open_rows -= 1
+            path = [ancestor.tag for ancestor in islice(element.iterancestors(), 10)]
+            abbr = _MATCH_TEAM_ABBR(element)
+            if path == _MATCH_TEAM_LINK_PATH and abbr:
+                dicinfo[element.get('href')[1:]] = abbr[0]
+        elif tag == 'tr':
+            open_rows -= 1
+            tbody = element.getparent()
+            if tbody is not None and tbody.tag == 'tbody' and tbody.getparent() in tables:
+                team, k = tables[tbody.getparent()]
+                if MATCH_TABLES[k][1] in element.get('class', ''):
+                    team_rows[team][k].append(_cell_texts(element))
+        elif tag == 'table':
+            tables.pop(element, None)
+        if open_rows == 0:
+            # Drop the element and its earlier siblings once read
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    # Fill a preallocated array per column; categories are set on the frame
+    n = sum(len(team_rows[team][0]) for team in teams)
+    columns = {col: np.empty(n, dtype=object if dtype == 'category' else dtype)
+               for col, dtype in MATCH_DTYPES.items()}
+    columns['schedule_id'][:] = int(matchid)
+    i = 0
+    for team in teams:
+        columns['nationality'][i:i + len(team_rows[team][0])] = dicinfo[team]
+        for player_rows in zip(*team_rows[team], strict=True):
+            for texts, (_, _, cells) in zip(player_rows, MATCH_TABLES):
+                for cls, col in cells:
+                    if col in MATCH_OPTIONAL_COLUMNS:
+                        text = texts.get('vbw-o-table__cell ' + cls, '').strip()
+                        columns[col][i] = float(text) if text else np.nan
+                    elif MATCH_DTYPES[col] == 'int16':
+                        columns[col][i] = int(texts['vbw-o-table__cell ' + cls])
+                    else:
+                        columns[col][i] = texts['vbw-o-table__cell ' + cls]
+            i += 1
+    return columns
+
+
+def get_one_match_data(matchid, season=2021):
+    """
+    Query for one match given the ID.
+    """
+    url = competition_url(season, 'schedule/' + matchid + '/_libraries/_finished-match')
+    pool = get_parse_pool()
+    if pool is None:
+        # The page is parsed while it is read
+        encoding, chunks = fetch_stream(url)
+        with timer('parse'):
+            columns = extract_match_columns(chunks, matchid, encoding)
+    else:
+        html = fetch(url)
+        with timer('parse'):
+            columns = pool.submit(match_page_columns, html.content, html.encoding,
+                                  matchid).result()
+    with timer('dataframe'):
+        df = pd.DataFrame(columns, columns=MATCH_COLUMNS).astype(MATCH_DTYPES)
     return df
 
-def get_matches_data_2021(matchid_list)
+
+def match_page_columns(content, encoding, matchid):
     """
-    Get detailed info for all matches.
+    Typed column arrays of a finished match page given as raw bytes.
+    Runs in the parse worker processes.
     """
-    totaldf = pd.DataFrame()
-    for k in range(len(matchid_list)):
-        print(k,matchid_list[k])
-        dftemp = get_one_match_data(matchid_list[k])
-        totaldf = pd.concat([totaldf,dftemp])
-    totaldf.to_csv('match2021.csv', index=False) 
-    return True
+    return extract_match_columns(iter_chunks(content), matchid, encoding)
+
+def match_genders_2021(out_dir='./'):
+    """
+    Gender ('women' or 'men') of every match in the stored schedule2021.csv,
+    by match ID.
+    """
+    fname = os.path.join(out_dir, SCHEDULE_2021_CSV)
+    if not os.path.exists(fname):
+        return {}
+    schedule = pd.read_csv(fname, usecols=['matchid', 'matchname'], dtype=str)
+    gender, _ = split_matchname(schedule['matchname'])
+    return dict(zip(schedule['matchid'], gender))
 
-def main():
-    player_df = get_player_bio_df()
-    save_csv(player_df, 'player_bio.csv')
 
-    team_rank_df = get_team_rank_with_match()
-    save_csv(team_rank_df, 'team_rank.csv')
+def read_matches_2021(fname, **kwargs):
+    """
+    Read stored 2021 match rows with the match data types.
+    """
+    # Files written before the columns were typed use ' ' for missing values
+    return pd.read_csv(fname, dtype=MATCH_DTYPES, na_values=[' '], **kwargs)
+
 
-    save_best_players()
+def save_matches_2021_parquet(out_dir, parquet_dir, chunksize=50000):
+    """
+    Copy matches2021.csv in out_dir into the Parquet dataset under
+    parquet_dir chunk by chunk, with the gender and stage of each match
+    taken from schedule2021.csv.
+    """
+    schedule = pd.read_csv(os.path.join(out_dir, SCHEDULE_2021_CSV),
+                           usecols=['matchid', 'matchname'])
+    gender, stage = split_matchname(schedule['matchname'])
+    gender.index = stage.index = schedule['matchid']
+    clear_parquet(parquet_dir, 'matches')
+    chunks = read_matches_2021(os.path.join(out_dir, MATCHES_2021_CSV), chunksize=chunksize)
+    for k, chunk in enumerate(chunks):
+        chunk['season'] = 2021
+        chunk['gender'] = chunk['schedule_id'].map(gender)
+        chunk['stage'] = chunk['schedule_id'].map(stage)
+        write_parquet(chunk, parquet_dir, 'matches', ['season', 'gender', 'stage'],
+                      MATCH_DTYPES, chunk=k)
+
+
+def iter_matches_data_2021(matchid_list, max_workers=None):
+    """
+    Yield (matchid, df) for every match in the order of matchid_list.
+    At most 2 * max_workers (default MAX_WORKERS) matches are fetched ahead
+    of the consumer, so memory use does not grow with the length of the list.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    ids = iter(matchid_list)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for matchid in islice(ids, 2 * max_workers):
+            pending.append((matchid, executor.submit(get_one_match_data, matchid)))
+        while pending:
+            matchid, future = pending.popleft()
+            df = future.result()
+            for next_id in islice(ids, 1):
+                pending.append((next_id, executor.submit(get_one_match_data, next_id)))
+            yield matchid, df
+
+
+def get_matches_data_2021(matchid_list, max_workers=None, incremental=False,
+                          out_dir='./', parquet_dir=None, source=None, sqlite_db=None):
+    """
+    Get detailed info for all matches.
+    Up to max_workers (default MAX_WORKERS) matches are requested at once;
+    the rows keep the order of matchid_list. Set max_workers=1 to crawl one
+    match at a time.
+
+    The rows of each match are streamed to disk as soon as it arrives, and a
+    checkpoint records the finished matches, so an interrupted run resumes
+    where it stopped. A full run writes to matches2021.csv.partial and
+    replaces matches2021.csv at the end. With incremental=True only matches
+    missing from the stored matches2021.csv are fetched and appended to it.
+
+    The season totals of every player and team are updated with the rows of
+    each new match only; see vnl_aggregate.SeasonAggregates.
+
+    source(todo) may yield the (matchid, df) of the matches to add instead
+    of fetching them, e.g. from the work queue of vnl_queue.py. With
+    sqlite_db set, the rows of every new match are upserted into its
+    matches table as they arrive.
+    """
+    fname = os.path.join(out_dir, MATCHES_2021_CSV)
+    target = fname if incremental else fname + '.partial'
+    genders = match_genders_2021(out_dir)
+
+    with CsvSink(target, MATCH_COLUMNS, append=incremental) as sink:
+        skip = set(sink.done)
+        if incremental:
+            stored = pd.read_csv(fname, usecols=['schedule_id'], dtype=str)
+            skip.update(stored['schedule_id'].unique())
+        todo = [matchid for matchid in matchid_list if matchid not in skip]
+        print('%d of %d matches to fetch' % (len(todo), len(matchid_list)))
+
+        aggregates_fname = os.path.join(out_dir, SEASON_AGGREGATES_2021)
+        if incremental:
+            aggregates = SeasonAggregates.load(aggregates_fname)
+        else:
+            # A full run rebuilds the totals
+            aggregates = SeasonAggregates()
+        # Add stored matches the totals miss, e.g. from an interrupted run
+        missing = skip - aggregates.applied
+        if missing:
+            for matchid, rows in read_matches_2021(target).groupby('schedule_id'):
+                if str(matchid) in missing:
+                    aggregates.update(matchid, rows, genders.get(str(matchid)))
+
+        if source is None:
+            matches = iter_matches_data_2021(todo, max_workers)
+        else:
+            matches = source(todo)
+        for k, (matchid, dftemp) in enumerate(matches):
+            print(k, matchid)
+            sink.append(matchid, dftemp)
+            if sqlite_db is not None:
+                save_sqlite(dftemp, sqlite_db, 'matches')
+            aggregates.update(matchid, dftemp, genders.get(matchid))
+            count('rows', len(dftemp))
+
+    if not incremental:
+        # A checkpoint left by an interrupted incremental run belongs to the
+        # file being replaced
+        if os.path.exists(fname + '.checkpoint'):
+            os.remove(fname + '.checkpoint')
+        os.replace(target, fname)
+    print(fname + ' saved.')
+    aggregates.save(aggregates_fname, os.path.join(out_dir, PLAYER_SEASON_2021_CSV),
+                    os.path.join(out_dir, TEAM_SEASON_2021_CSV))
+    if parquet_dir is not None:
+        save_matches_2021_parquet(out_dir, parquet_dir)
+    return True
 
-    match_summary_df = get_match_summary()
-    save_csv(match_summary_df, 'round_robin.csv')
 
-    ## Get 2021 per match data
-    matchid_list = get_vnl_schedule_2021()
-    get_matches_data_2021(matchid_list)
+def save_match_summary_2021(out_dir='./', parquet_dir=None, sqlite_db=None):
+    """
+    Save the per-(schedule_id, team) summary of the 2021 matches, built
+    from the schedule and match data stored in out_dir.
+    """
+    schedule = pd.read_csv(os.path.join(out_dir, SCHEDULE_2021_CSV))
+    matches = read_matches_2021(os.path.join(out_dir, MATCHES_2021_CSV))
+    with timer('dataframe'):
+        summary = match_summary(matches, schedule)
+    fname = os.path.join(out_dir, MATCH_SUMMARY_2021_CSV)
+    summary.to_csv(fname, index=False)
+    count('rows', len(summary))
+    print(fname + ' saved.')
+    if parquet_dir is not None:
+        clear_parquet(parquet_dir, 'match_summary')
+        # Partition on 'women'/'men' like the other datasets; the csv keeps
+        # the names of the schedule
+        write_parquet(summary.assign(season=2021, gender=summary['gender'].str.lower()),
+                      parquet_dir, 'match_summary', ['season', 'gender'], MATCH_SUMMARY_DTYPES)
+    if sqlite_db is not None:
+        save_sqlite(summary, sqlite_db, 'match_summary')
+    return summary
+
+
+# Column types of the match_summary Parquet dataset, whose gender is a
+# partition column
+MATCH_SUMMARY_DTYPES = {'schedule_id': 'int32', 'team': 'category', 'opponent': 'category',
+                        'score': 'int8', 'opponent_score': 'int8', 'sets_win': 'int8',
+                        'points': 'int16', 'opponent_points': 'int16', 'point_diff': 'int16',
+                        'attack_eff': 'float64', 'block_eff': 'float64',
+                        'opponent_block_eff': 'float64', 'serve_eff': 'float64',
+                        'set_name': 'object', 'set_pt': 'int16', 'set_err': 'int16',
+                        'set_tot': 'int16', 'set_eff': 'float64',
+                        'reception_name': 'object', 'reception_successful': 'int16',
+                        'reception_err': 'int16', 'reception_tot': 'int16',
+                        'reception_eff': 'float64',
+                        'dig_name': 'object', 'dig_digs': 'int16', 'dig_err': 'int16',
+                        'dig_tot': 'int16', 'dig_eff': 'float64'}
+
+
+# Stages of a full run, in the order they run
+STAGE_NAMES = ['bio', 'team_rank', 'best_players', 'round_robin', 'schedule_2021', 'matches_2021',
+               'match_summary_2021']
+
+
+def main(stages=STAGE_NAMES, out_dir='./', parquet_dir=None, incremental=False,
+         report=None, profile=False, trace_memory=False, sqlite_db=None, max_workers=None):
+    """
+    Run the given stages, saving their csv files in out_dir (and Parquet
+    datasets under parquet_dir, and tables of the sqlite store sqlite_db).
+    The bio and 2021 match stages fetch pages on max_workers threads
+    (default MAX_WORKERS).
+    With report set, per-stage metrics are
+    saved to that JSON file; profile and trace_memory add cProfile and
+    tracemalloc results. See vnl_cli.py for the command line.
+    """
+    def run_stage(name):
+        return stage(name, profile=profile, trace_memory=trace_memory)
+
+    # Fork the parse workers before any fetching thread runs
+    get_parse_pool()
+    try:
+        if 'bio' in stages:
+            with run_stage('bio'):
+                player_df = get_player_bio_df(max_workers)
+                save_csv(player_df, 'player_bio.csv', out_dir, parquet_dir, sqlite_db=sqlite_db)
+
+        if 'team_rank' in stages:
+            with run_stage('team_rank'):
+                team_rank_df = get_team_rank_with_match()
+                save_csv(team_rank_df, 'team_rank.csv', out_dir, parquet_dir, sqlite_db=sqlite_db)
+
+        if 'best_players' in stages:
+            with run_stage('best_players'):
+                save_best_players(out_dir, parquet_dir, sqlite_db)
+
+        if 'round_robin' in stages:
+            with run_stage('round_robin'):
+                match_summary_df = get_match_summary()
+                save_csv(match_summary_df, 'round_robin.csv', out_dir, parquet_dir,
+                         sqlite_db=sqlite_db)
+        # Release the 2019 pages kept for reuse by the stages above
+        PAGES.clear()
+
+        ## Get 2021 per match data
+        matchid_list = None
+        if 'schedule_2021' in stages:
+            with run_stage('schedule_2021'):
+                matchid_list = get_vnl_schedule_2021(out_dir, parquet_dir, sqlite_db)
+        if 'matches_2021' in stages:
+            with run_stage('matches_2021'):
+                if matchid_list is None:
+                    matchid_list = read_matchids_2021(out_dir)
+                get_matches_data_2021(matchid_list, max_workers, incremental=incremental,
+                                      out_dir=out_dir, parquet_dir=parquet_dir, sqlite_db=sqlite_db)
+        if 'match_summary_2021' in stages:
+            with run_stage('match_summary_2021'):
+                save_match_summary_2021(out_dir, parquet_dir, sqlite_db)
+    finally:
+        close_parse_pool()
+    if report is not None:
+        write_report(report)
 
 if __name__ == '__main__':
-    main()
+    import vnl_cli
+    vnl_cli.main()
@@ -0,0 +1,93 @@
+"""
+Resume logic of the streamed matches2021.csv: checkpoints of interrupted
+runs and how full and incremental runs pick them up. Matches come from the
+stored matches2021.csv, so no page is fetched.
+"""
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import get_vnl_data
+from vnl_store import CsvSink
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def stored_matches():
+    matches = get_vnl_data.read_matches_2021(os.path.join(DATA_DIR, get_vnl_data.MATCHES_2021_CSV))
+    return {str(matchid): rows for matchid, rows in matches.groupby('schedule_id', sort=False)}
+
+
+@pytest.fixture
+def out_dir(tmp_path):
+    shutil.copy(os.path.join(DATA_DIR, get_vnl_data.SCHEDULE_2021_CSV), tmp_path)
+    return str(tmp_path)
+
+
+def source_of(stored_matches, fetched, stop_after=None):
+    def source(todo):
+        for k, matchid in enumerate(todo):
+            if k == stop_after:
+                raise KeyboardInterrupt
+            fetched.append(matchid)
+            yield matchid, stored_matches[matchid]
+    return source
+
+
+def run(out_dir, stored_matches, ids, incremental=False, stop_after=None):
+    fetched = []
+    get_vnl_data.get_matches_data_2021(ids, incremental=incremental, out_dir=out_dir,
+                                       source=source_of(stored_matches, fetched, stop_after))
+    return fetched
+
+
+def stored_ids(out_dir):
+    matches = get_vnl_data.read_matches_2021(os.path.join(out_dir, get_vnl_data.MATCHES_2021_CSV))
+    return [str(matchid) for matchid in matches['schedule_id'].unique()]
+
+
+def test_interrupted_incremental_then_full_then_incremental(out_dir, stored_matches):
+    ids = list(stored_matches)[:30]
+    run(out_dir, stored_matches, ids[:10])
+
+    with pytest.raises(KeyboardInterrupt):
+        run(out_dir, stored_matches, ids[:25], incremental=True, stop_after=5)
+    fname = os.path.join(out_dir, get_vnl_data.MATCHES_2021_CSV)
+    assert os.path.exists(fname + '.checkpoint')
+
+    # The full run replaces the file the checkpoint was written for
+    run(out_dir, stored_matches, ids[:20])
+    assert not os.path.exists(fname + '.checkpoint')
+
+    assert run(out_dir, stored_matches, ids, incremental=True) == ids[20:]
+    assert stored_ids(out_dir) == ids
+    assert not os.path.exists(fname + '.checkpoint')
+
+
+def test_interrupted_incremental_resumes(out_dir, stored_matches):
+    ids = list(stored_matches)[:20]
+    run(out_dir, stored_matches, ids[:10])
+    with pytest.raises(KeyboardInterrupt):
+        run(out_dir, stored_matches, ids, incremental=True, stop_after=5)
+    assert run(out_dir, stored_matches, ids, incremental=True) == ids[15:]
+    assert stored_ids(out_dir) == ids
+
+
+@pytest.mark.parametrize('size', [10 ** 6, 5])
+def test_csv_sink_drops_checkpoint_not_matching_file(tmp_path, size):
+    fname = str(tmp_path / 'rows.csv')
+    with open(fname, 'w') as f:
+        f.write('a,b\n1,2\n3,4\n')
+    with open(fname + '.checkpoint', 'w') as f:
+        json.dump({'done': ['x'], 'size': size}, f)
+
+    sink = CsvSink(fname, ['a', 'b'], append=True)
+    sink.append('y', pd.DataFrame({'a': [5], 'b': [6]}))
+    sink.close()
+    assert sink.done == ['y']
+    with open(fname) as f:
+        assert f.read() == 'a,b\n1,2\n3,4\n5,6\n'
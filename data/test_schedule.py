@@ -0,0 +1,51 @@
+"""
+Set scores of the 2021 schedule, parsed from the span layout of the site:
+home, '-', away for every played set.
+"""
+import ast
+import os
+
+import pandas as pd
+
+import get_vnl_data
+import vnl_fixtures
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+TITLES = ['matchid', 'matchname', 'teamhome', 'teamaway', 'scorehome', 'awayhome']
+
+
+def stored_schedule():
+    return pd.read_csv(os.path.join(DATA_DIR, get_vnl_data.SCHEDULE_2021_CSV), dtype={'matchid': str})
+
+
+def test_old_span_format():
+    # schedule2021_old.csv keeps the spans as the site served them
+    old = pd.read_csv(os.path.join(DATA_DIR, 'schedule2021_old.csv'), dtype=str)
+    infoslist = [row[TITLES].tolist() + [ast.literal_eval(row['result'])]
+                 for _, row in old.iterrows()]
+    schedule = get_vnl_data._schedule_df(infoslist, TITLES)
+
+    stored = stored_schedule()
+    columns = get_vnl_data.SET_COLUMNS + list(get_vnl_data.SET_TOTAL_DTYPES)
+    pd.testing.assert_frame_equal(schedule[columns].astype('float64'),
+                                  stored[columns].astype('float64'))
+
+    three_sets = schedule.set_index('matchid').loc['11830']
+    assert (three_sets['set1_home'], three_sets['set1_away']) == (25, 21)
+    assert pd.isna(three_sets['set4_home']) and pd.isna(three_sets['set5_away'])
+    assert (three_sets['points_home'], three_sets['points_away']) == (75, 58)
+
+    five_sets = schedule.set_index('matchid').loc['11831']
+    assert (five_sets['set5_home'], five_sets['set5_away']) == (16, 14)
+    assert five_sets['sets_played'] == 5
+    assert (five_sets['points_home'], five_sets['points_away']) == (106, 108)
+
+
+def test_fixture_schedule_page(tmp_path):
+    # The fixture page rebuilt from schedule2021.csv parses back to the same file
+    tree = get_vnl_data.parse_content(vnl_fixtures.schedule_page().encode('utf-8'))
+    schedule = get_vnl_data._schedule_df(get_vnl_data._schedule_rows(tree), TITLES)
+    fname = tmp_path / get_vnl_data.SCHEDULE_2021_CSV
+    schedule.to_csv(fname, index=False)
+    with open(os.path.join(DATA_DIR, get_vnl_data.SCHEDULE_2021_CSV), 'rb') as f:
+        assert fname.read_bytes() == f.read()
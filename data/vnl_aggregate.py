@@ -0,0 +1,178 @@
+"""
+Aggregates of the 2021 match data, computed by the scraper so the reports
+can load them directly: the per-match team summary and the running season
+totals of every player and team.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from vnl_store import split_matchname
+
+# Per-match leaders: (skill, name column, stat columns). The player of each
+# team with the most attempts at the skill is kept, the first one on ties.
+MATCH_LEADERS = [
+    ('set', 'set_name', ['set_pt', 'set_err', 'set_tot', 'set_eff']),
+    ('reception', 'reception_name', ['reception_successful', 'reception_err',
+                                     'reception_tot', 'reception_eff']),
+    ('dig', 'dig_name', ['dig_digs', 'dig_err', 'dig_tot', 'dig_eff']),
+]
+
+MATCH_SUMMARY_COLUMNS = [
+    'schedule_id', 'team', 'opponent', 'gender', 'score', 'opponent_score', 'sets_win',
+    'points', 'opponent_points', 'point_diff', 'attack_eff', 'block_eff',
+    'opponent_block_eff', 'serve_eff'] + \
+    [col for _, name, stats in MATCH_LEADERS for col in [name] + stats]
+
+
+def team_sides(schedule):
+    """
+    One row per team and match of the schedule, seen from that team.
+    """
+    schedule = schedule.rename(columns={'matchid': 'schedule_id'})
+    # Keep the capitalized 'Women' and 'Men' of the match names, which the
+    # reports filter on
+    gender, _ = split_matchname(schedule['matchname'])
+    gender = gender.str.capitalize()
+    home = pd.DataFrame({'schedule_id': schedule['schedule_id'], 'team': schedule['teamhome'],
+                         'opponent': schedule['teamaway'], 'gender': gender,
+                         'score': schedule['scorehome'], 'opponent_score': schedule['awayhome'],
+                         'points': schedule['points_home']})
+    away = pd.DataFrame({'schedule_id': schedule['schedule_id'], 'team': schedule['teamaway'],
+                         'opponent': schedule['teamhome'], 'gender': gender,
+                         'score': schedule['awayhome'], 'opponent_score': schedule['scorehome'],
+                         'points': schedule['points_away']})
+    return pd.concat([home, away], ignore_index=True)
+
+
+def match_summary(matches, schedule):
+    """
+    Per-(schedule_id, team) summary of the 2021 matches, as built by
+    process_vnl_data.R: total attack, block and serve efficiencies, the set,
+    reception and dig leaders, and the score and points of both teams.
+    """
+    keys = ['schedule_id', 'team']
+    matches = matches.rename(columns={'nationality': 'team'})
+    matches['team'] = matches['team'].astype(str)
+    groups = matches.groupby(keys, sort=True)
+
+    # (points - errors) / total over all players of the team
+    sums = groups[['attack_pt', 'attack_err', 'attack_tot', 'block_pt', 'block_err', 'block_tot',
+                   'serve_pt', 'serve_err', 'serve_tot']].sum().astype('float64')
+    summary = pd.DataFrame(index=sums.index)
+    for skill in ['attack', 'block', 'serve']:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eff = (sums[skill + '_pt'] - sums[skill + '_err']) / sums[skill + '_tot']
+        summary[skill + '_eff'] = eff.round(4)
+
+    for skill, name, stats in MATCH_LEADERS:
+        leaders = matches.loc[groups[skill + '_tot'].idxmax(), keys + ['name'] + stats]
+        leaders = leaders.rename(columns={'name': name}).set_index(keys)
+        leaders[skill + '_eff'] = leaders[skill + '_eff'] / 100
+        summary = summary.join(leaders)
+    summary = summary.reset_index()
+
+    summary = summary.merge(team_sides(schedule), on=keys, how='left')
+    summary['sets_win'] = summary['score'] - summary['opponent_score']
+    opponents = summary[['schedule_id', 'team', 'block_eff', 'points']].rename(
+        columns={'team': 'opponent', 'block_eff': 'opponent_block_eff',
+                 'points': 'opponent_points'})
+    summary = summary.merge(opponents, on=['schedule_id', 'opponent'], how='left')
+    summary['point_diff'] = summary['points'] - summary['opponent_points']
+    return summary[MATCH_SUMMARY_COLUMNS]
+
+
+# Season totals kept per player and per team
+SEASON_STATS = ['attack_pt', 'attack_err', 'attack_tot', 'block_pt', 'block_err', 'block_tot',
+                'serve_pt', 'serve_err', 'serve_tot', 'reception_successful', 'reception_err',
+                'reception_tot', 'dig_digs', 'dig_err', 'dig_tot', 'set_pt', 'set_err', 'set_tot']
+
+
+def _row_order(item):
+    # The gender of a match missing from the schedule is None; its rows
+    # come first
+    gender, *rest = item[0]
+    return (gender is not None, gender or '', *rest)
+
+
+class SeasonAggregates:
+    """
+    Running per-player and per-team season totals of the match data.
+
+    update(schedule_id, df, gender) adds the rows of one match and remembers
+    its schedule_id, so it costs O(rows in the match) and adding a match
+    twice changes nothing. Gender is part of the keys because the men's and
+    women's teams of a country share its abbreviation. The state is saved as one JSON file, replaced
+    atomically, next to csv exports of both tables.
+    """
+    def __init__(self):
+        self.applied = set()
+        # (gender, nationality, number) -> [name, position, matches, *SEASON_STATS]
+        self.players = {}
+        # (gender, nationality) -> [matches, *SEASON_STATS]
+        self.teams = {}
+
+    @classmethod
+    def load(cls, fname):
+        aggregates = cls()
+        if os.path.exists(fname):
+            with open(fname) as f:
+                state = json.load(f)
+            aggregates.applied = set(state['applied'])
+            aggregates.players = {tuple(key): row for key, row in state['players']}
+            aggregates.teams = {tuple(key): row for key, row in state['teams']}
+        return aggregates
+
+    def update(self, schedule_id, df, gender):
+        """
+        Add the rows of the match schedule_id unless they were added before.
+        Return True if they were added.
+        """
+        schedule_id = str(schedule_id)
+        if schedule_id in self.applied:
+            return False
+        stats = df[SEASON_STATS].to_numpy(dtype='int64')
+        teams = df['nationality'].astype(str).to_numpy()
+        for team, number, name, position, values in zip(
+                teams, df['number'].to_numpy(), df['name'], df['position'].astype(str), stats):
+            key = (gender, team, int(number))
+            if key not in self.players:
+                self.players[key] = [name, position, 0] + [0] * len(SEASON_STATS)
+            row = self.players[key]
+            row[0], row[1] = name, position
+            row[2] += 1
+            row[3:] = (np.array(row[3:]) + values).tolist()
+        for team in pd.unique(teams):
+            if (gender, team) not in self.teams:
+                self.teams[gender, team] = [0] * (len(SEASON_STATS) + 1)
+            row = self.teams[gender, team]
+            row[0] += 1
+            row[1:] = (np.array(row[1:]) + stats[teams == team].sum(axis=0)).tolist()
+        self.applied.add(schedule_id)
+        return True
+
+    def player_df(self):
+        rows = [list(key) + row for key, row in sorted(self.players.items(), key=_row_order)]
+        return pd.DataFrame(rows, columns=['gender', 'nationality', 'number', 'name', 'position',
+                                           'matches'] + SEASON_STATS)
+
+    def team_df(self):
+        rows = [list(key) + row for key, row in sorted(self.teams.items(), key=_row_order)]
+        return pd.DataFrame(rows, columns=['gender', 'nationality', 'matches'] + SEASON_STATS)
+
+    def save(self, fname, player_csv=None, team_csv=None):
+        """
+        Save the state to fname and optionally export the two tables.
+        """
+        state = {'applied': sorted(self.applied),
+                 'players': [[key, row] for key, row in self.players.items()],
+                 'teams': [[key, row] for key, row in self.teams.items()]}
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(fname + '.tmp', fname)
+        if player_csv is not None:
+            self.player_df().to_csv(player_csv, index=False)
+        if team_csv is not None:
+            self.team_df().to_csv(team_csv, index=False)
@@ -0,0 +1,125 @@
+"""
+Append-only archive of every page fetched by the scraper.
+
+Pages are written to pages.warc.gz as one gzip member per page, each holding
+a small WARC-like header and the raw body, so the whole file can be read
+with zcat. pages.idx holds one fixed-size record per page (URL hash, fetch
+time, offset and length of the gzip member) and is memory-mapped for
+lookups. With vnl_http.replay(archive) every fetch is answered from the
+archive, so the extractors can be rerun without network access.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from vnl_cache import CachedResponse
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.vnl_archive')
+
+INDEX_DTYPE = np.dtype([('url_hash', '<u8'), ('fetched_at', '<f8'),
+                        ('offset', '<u8'), ('length', '<u4'), ('status', '<u4')])
+
+
+def url_hash(url):
+    return int.from_bytes(hashlib.sha1(url.encode('utf-8')).digest()[:8], 'little')
+
+
+class PageArchive:
+    """
+    Compressed page archive with an offset index keyed by URL and fetch time.
+    """
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        self.data_fname = os.path.join(path, 'pages.warc.gz')
+        self.index_fname = os.path.join(path, 'pages.idx')
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._repair()
+
+    def _repair(self):
+        # Cut off a page that was being written when a run was killed: index
+        # records are written after their data, so the index is the truth.
+        with open(self.index_fname, 'ab') as f:
+            size = f.tell()
+            f.truncate(size - size % INDEX_DTYPE.itemsize)
+        end = 0
+        index = self.index()
+        if len(index):
+            end = int(index['offset'][-1]) + int(index['length'][-1])
+        with open(self.data_fname, 'ab') as f:
+            f.truncate(end)
+
+    def index(self):
+        """
+        The index records as a memory-mapped structured array.
+        """
+        size = os.path.getsize(self.index_fname)
+        if self._index is None or self._index.nbytes != size:
+            if size == 0:
+                self._index = np.empty(0, dtype=INDEX_DTYPE)
+            else:
+                self._index = np.memmap(self.index_fname, dtype=INDEX_DTYPE, mode='r')
+        return self._index
+
+    def append(self, url, response, fetched_at=None):
+        """
+        Add a downloaded page to the archive.
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        encoding = response.encoding or ''
+        header = ('VNL-ARCHIVE/1\r\nURL: %s\r\nFetched-At: %.6f\r\nStatus: %d\r\n'
+                  'Encoding: %s\r\nContent-Length: %d\r\n\r\n'
+                  % (url, fetched_at, response.status_code, encoding, len(response.content)))
+        member = gzip.compress(header.encode('utf-8') + response.content + b'\r\n\r\n',
+                               mtime=0)
+        with self._lock:
+            with open(self.data_fname, 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+            record = np.array([(url_hash(url), fetched_at, offset, len(member),
+                                response.status_code)], dtype=INDEX_DTYPE)
+            with open(self.index_fname, 'ab') as f:
+                f.write(record.tobytes())
+
+    def read(self, offset, length):
+        """
+        Read one archived page as (headers, body).
+        """
+        with open(self.data_fname, 'rb') as f:
+            f.seek(offset)
+            raw = gzip.decompress(f.read(length))
+        head, _, rest = raw.partition(b'\r\n\r\n')
+        headers = dict(line.split(': ', 1) for line in head.decode('utf-8').split('\r\n')[1:])
+        body = rest[:int(headers['Content-Length'])]
+        return headers, body
+
+    def lookup(self, url, as_of=None):
+        """
+        Return the latest archived copy of url as a CachedResponse, or None.
+        With as_of, only copies fetched at or before that time are used.
+        """
+        index = self.index()
+        matches = np.flatnonzero(index['url_hash'] == url_hash(url))
+        if as_of is not None:
+            matches = matches[index['fetched_at'][matches] <= as_of]
+        # Newest first; the URL in the header guards against hash collisions
+        for i in matches[np.argsort(index['fetched_at'][matches], kind='stable')[::-1]]:
+            headers, body = self.read(int(index['offset'][i]), int(index['length'][i]))
+            if headers['URL'] == url:
+                return CachedResponse(url, body, headers['Encoding'] or None,
+                                      int(headers['Status']), from_cache=True)
+        return None
+
+    def urls(self):
+        """
+        Yield (url, fetched_at) for every archived page, in archive order.
+        """
+        index = self.index()
+        for i in range(len(index)):
+            headers, _ = self.read(int(index['offset'][i]), int(index['length'][i]))
+            yield headers['URL'], float(headers['Fetched-At'])
@@ -0,0 +1,239 @@
+"""
+On-disk cache for the pages downloaded by get_vnl_data.py.
+
+Bodies are stored as files under the cache directory, one per (url, headers)
+key, and a small sqlite index keeps the validators, fetch time and last
+access time of every entry.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.vnl_cache')
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+# Seconds a cached page stays fresh, by URL pattern. The first matching
+# pattern wins and None means the page never goes stale.
+DEFAULT_TTLS = [
+    (r'/_finished-match$', None),   # a finished match page never changes
+    (r'/vnl/2019/', None),          # the 2019 season is over
+    (r'/schedule/?$', 60 * 60),     # the 2021 schedule fills in as matches end
+    (r'', 24 * 60 * 60),
+]
+
+
+class CachedResponse:
+    """
+    The parts of a requests.Response the scraper uses, for cached pages.
+    The body is either given as content or read from the open file body.
+    """
+    def __init__(self, url, content, encoding=None, status_code=200, from_cache=False,
+                 body=None):
+        self.url = url
+        self._content = content
+        self._body = body
+        self.encoding = encoding
+        self.status_code = status_code
+        self.from_cache = from_cache
+
+    @property
+    def content(self):
+        if self._content is None and self._body is not None:
+            with self._body:
+                self._content = self._body.read()
+            self._body = None
+        return self._content
+
+    def close(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def iter_content(self, chunk_size):
+        """
+        Yield the body in pieces of at most chunk_size bytes, reading it
+        from its file piece by piece if it was not loaded.
+        """
+        if self._body is None:
+            content = self.content
+            for start in range(0, len(content), chunk_size):
+                yield content[start:start + chunk_size]
+            return
+        with self._body:
+            for chunk in iter(lambda: self._body.read(chunk_size), b''):
+                yield chunk
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class ResponseCache:
+    """
+    Content cache keyed by URL and request headers, with per-URL-pattern TTLs,
+    ETag/Last-Modified revalidation and LRU eviction above max_bytes.
+    """
+    def __init__(self, path=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, ttls=DEFAULT_TTLS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # Connect lazily so importing the scraper does not touch the disk
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.path, 'index.sqlite'),
+                                         check_same_thread=False)
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT,
+                encoding TEXT, fetched_at REAL, accessed_at REAL, size INTEGER)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        return self._conn
+
+    def _body_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    @staticmethod
+    def key(url, headers=None):
+        raw = json.dumps([url, sorted((headers or {}).items())])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def ttl(self, url):
+        """
+        Seconds the page at url stays fresh, or None if it never expires.
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def lookup(self, url, headers=None, stream=False):
+        """
+        Return (response, fresh, validators) for a cached page, or None.
+        validators holds the conditional request headers for revalidation.
+        With stream the body is left in its open file for iter_content().
+        """
+        key = self.key(url, headers)
+        with self._lock:
+            row = self._db().execute(
+                "SELECT etag, last_modified, encoding, fetched_at FROM entries WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                # An open file stays readable if the entry is evicted
+                body = open(self._body_path(key), 'rb')
+            except FileNotFoundError:
+                self._db().execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db().commit()
+                return None
+            self._db().execute("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                               (time.time(), key))
+            self._db().commit()
+        etag, last_modified, encoding, fetched_at = row
+        ttl = self.ttl(url)
+        fresh = ttl is None or time.time() - fetched_at < ttl
+        validators = {}
+        if etag:
+            validators['If-None-Match'] = etag
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        response = CachedResponse(url, None, encoding, from_cache=True, body=body)
+        if not stream:
+            response.content
+        return response, fresh, validators
+
+    def revalidated(self, url, headers=None):
+        """
+        Mark a cached page as fresh again after a 304 Not Modified.
+        """
+        with self._lock:
+            self._db().execute("UPDATE entries SET fetched_at = ? WHERE key = ?",
+                               (time.time(), self.key(url, headers)))
+            self._db().commit()
+
+    def store(self, url, headers, response):
+        """
+        Save a requests.Response and return it as a CachedResponse.
+        """
+        key = self.key(url, headers)
+        encoding = response.encoding or response.apparent_encoding
+        content = response.content
+        tmp_path = self._tmp_path(key)
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        self._add(key, url, response, encoding, tmp_path, len(content))
+        return CachedResponse(url, content, encoding, response.status_code)
+
+    def store_stream(self, url, headers, response, chunks):
+        """
+        Pass on the chunks of a streamed requests.Response while writing
+        them to a temporary body file; the page is added to the cache once
+        the last chunk is through. A stream that is not read to its end is
+        not cached.
+        """
+        key = self.key(url, headers)
+        tmp_path = self._tmp_path(key)
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            self._add(key, url, response, response.encoding, tmp_path, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _tmp_path(self, key):
+        body_path = self._body_path(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        # Unique per process and thread, as several workers share the cache
+        return '%s.%d.%d.tmp' % (body_path, os.getpid(), threading.get_ident())
+
+    def _add(self, key, url, response, encoding, tmp_path, size):
+        os.replace(tmp_path, self._body_path(key))
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 encoding, now, now, size))
+            self._evict()
+            self._db().commit()
+
+    def _evict(self):
+        # Drop the least recently used pages until the cache fits in max_bytes
+        db = self._db()
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self._body_path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove every cached page.
+        """
+        with self._lock:
+            for (key,) in self._db().execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self._body_path(key))
+                except FileNotFoundError:
+                    pass
+            self._db().execute("DELETE FROM entries")
+            self._db().commit()
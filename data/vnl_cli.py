@@ -0,0 +1,104 @@
+"""
+Command line entry point of the VNL scraper.
+
+Every stage is a subcommand, so a cron job can run only what changed:
+
+    python vnl_cli.py schedule-2021 --out-dir ./
+    python vnl_cli.py matches-2021 --incremental
+    python vnl_cli.py all --parquet-dir ./parquet
+    python vnl_cli.py matches-2021 --incremental --sqlite vnl.sqlite
+
+The scraper modules (pandas, lxml, requests) are only imported once a stage
+runs, so --help and mistyped commands return at once. Any stage loads all
+of them, about half a second, since get_vnl_data imports them at the top;
+only pyarrow waits until Parquet output is written.
+"""
+import argparse
+import os
+import sys
+
+import vnl_ratelimit
+
+STAGES = [('bio', 'player bios and positions of the 2019 rosters'),
+          ('team-rank', '2019 round robin team ranking'),
+          ('best-players', '2019 best player tables'),
+          ('round-robin', '2019 round robin match results'),
+          ('schedule-2021', '2021 schedule and match results'),
+          ('matches-2021', '2021 per-player match statistics'),
+          ('match-summary-2021', 'per-team summary of every 2021 match, from the stored csv files'),
+          ('all', 'every stage above, in order')]
+
+
+def make_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--out-dir', default='./', help='directory for the csv files')
+    common.add_argument('--parquet-dir', '--parquet', metavar='DIR',
+                        help='also write partitioned Parquet datasets under DIR')
+    common.add_argument('--sqlite', metavar='DB',
+                        help='also upsert every dataset into the indexed sqlite store DB')
+    common.add_argument('--rps', type=float, default=vnl_ratelimit.RATE,
+                        help='requests per second allowed to each host (0 for no limit)')
+    common.add_argument('--workers', type=int,
+                        help='threads fetching player and 2021 match pages (default 8)')
+    common.add_argument('--parse-processes', type=int,
+                        help='parse match and table pages in this many worker processes')
+    common.add_argument('--archive', metavar='DIR',
+                        help='add every fetched page, also from the cache, to the page archive in DIR')
+    common.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the on-disk page cache')
+    common.add_argument('--replay', metavar='DIR',
+                        help='read every page from the archive in DIR instead of the network')
+    common.add_argument('--report', metavar='FILE',
+                        help='save per-stage requests, bytes, cache hits, timings and memory as JSON')
+    common.add_argument('--profile', action='store_true',
+                        help='add the top cProfile functions of each stage to the report')
+    common.add_argument('--trace-memory', action='store_true',
+                        help='add tracemalloc peaks and allocation sites of each stage to the report')
+
+    parser = argparse.ArgumentParser(description='Scrape the VNL data sets.')
+    subparsers = parser.add_subparsers(dest='stage', metavar='STAGE')
+    subparsers.required = True
+    for name, help in STAGES:
+        subparser = subparsers.add_parser(name, parents=[common], help=help)
+        if name in ('matches-2021', 'all'):
+            subparser.add_argument('--incremental', action='store_true',
+                                   help='only fetch 2021 matches missing from matches2021.csv')
+    return parser
+
+
+def run(args):
+    # Imported here so that the command line is parsed without loading them
+    import get_vnl_data
+    import vnl_http
+    from vnl_archive import PageArchive
+
+    get_vnl_data.PARSE_PROCESSES = args.parse_processes
+    vnl_http.set_rate_limit(args.rps)
+    if args.archive:
+        vnl_http.ARCHIVE = PageArchive(args.archive)
+    if args.no_cache:
+        vnl_http.CACHE = None
+    if args.replay:
+        vnl_http.replay(PageArchive(args.replay))
+
+    if args.stage == 'all':
+        stages = get_vnl_data.STAGE_NAMES
+    else:
+        stages = [args.stage.replace('-', '_')]
+    os.makedirs(args.out_dir, exist_ok=True)
+    get_vnl_data.main(stages, args.out_dir, args.parquet_dir,
+                      incremental=getattr(args, 'incremental', False), report=args.report,
+                      profile=args.profile, trace_memory=args.trace_memory, sqlite_db=args.sqlite,
+                      max_workers=args.workers)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Calls without a stage, as before the subcommands, run every stage
+    if not argv or argv[0].startswith('--') and argv[0] != '--help':
+        argv = ['all'] + argv
+    run(make_parser().parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Crawl several VNL seasons and genders in one run.
+
+Every (season, gender) target is turned into page tasks on one frontier.
+Index pages (statistics, rankings, rosters, schedules) are handed out before
+leaf pages (players, matches), a page shared by several targets (such as the
+schedule of a season, which lists both genders) is queued once, and all
+tasks run on one thread pool of max_workers. Tasks discovered by a page
+(the players of a roster, the matches of a schedule) join the frontier as
+soon as that page is done.
+
+    python vnl_crawl.py 2019/women 2019/men 2021/women 2021/men --out ./backfill
+"""
+import argparse
+import heapq
+import itertools
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import get_vnl_data
+import vnl_http
+from vnl_archive import PageArchive
+from vnl_store import split_matchname
+
+# Seasons served by the old site; later seasons use the competition site
+LEGACY_SEASONS = (2018, 2019)
+
+INDEX, LEAF = 0, 1
+
+Target = namedtuple('Target', ['season', 'gender'])
+# kind selects the handler, key deduplicates the task on the frontier
+Task = namedtuple('Task', ['priority', 'kind', 'key', 'args'])
+
+
+def parse_target(text):
+    """
+    Parse a target such as '2019/women'.
+    """
+    season, gender = text.split('/')
+    if gender not in get_vnl_data.TEAMS:
+        raise ValueError('unknown gender %r in target %r' % (gender, text))
+    return Target(int(season), gender)
+
+
+class Frontier:
+    """
+    Priority queue of tasks that drops tasks whose key was already queued.
+    Tasks of equal priority come out in the order they were pushed.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seen = set()
+        self._order = itertools.count()
+
+    def push(self, task):
+        if task.key in self._seen:
+            return False
+        self._seen.add(task.key)
+        heapq.heappush(self._heap, (task.priority, next(self._order), task))
+        return True
+
+    def pop(self):
+        return heapq.heappop(self._heap)[2]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+def seed_tasks(targets):
+    """
+    Index tasks of every target.
+    """
+    for target in targets:
+        season, gender = target
+        if season in LEGACY_SEASONS:
+            yield Task(INDEX, 'best_players', ('statistics', target), (target,))
+            # The standings on this page list the teams of the season, whose
+            # rosters it queues
+            yield Task(INDEX, 'round1', ('round1', target), (target,))
+        else:
+            # One schedule page lists the matches of both genders
+            yield Task(INDEX, 'schedule', ('schedule', season), (season,))
+
+
+class Crawl:
+    """
+    State of one crawl: the targets and the frames collected for them.
+    """
+    def __init__(self, targets):
+        self.targets = targets
+        self.tables = {}                    # (target, dataset) -> frame
+        self.teams = {}                     # target -> teams in standings order
+        self.rosters = {}                   # (target, team) -> roster frame
+        self.positions = {}                 # (target, team, k) -> position
+        self.schedules = {}                 # target -> schedule frame
+        self.matches = {}                   # (season, matchid) -> match frame
+        self.failed = []
+
+    def run_task(self, task):
+        """
+        Fetch and parse the page of a task; return the new tasks it found.
+        Runs on the worker threads.
+        """
+        return getattr(self, 'task_' + task.kind)(*task.args) or []
+
+    def task_best_players(self, target):
+        for name, df in get_vnl_data.get_best_players(*target):
+            self.tables[target, name] = df
+
+    def task_round1(self, target):
+        team_rank = get_vnl_data.get_team_rank_with_match(*target)
+        self.tables[target, 'team_rank'] = team_rank
+        self.tables[target, 'round_robin'] = get_vnl_data.get_match_summary(*target)
+        # A team without a known abbreviation fails its own roster task
+        self.teams[target] = list(team_rank['team_full'].str.lower())
+        return [Task(INDEX, 'roster', ('roster', target, team), (target, team))
+                for team in self.teams[target]]
+
+    def task_roster(self, target, team):
+        player_df, player_links = get_vnl_data.get_team_roster(team, *target)
+        self.rosters[target, team] = player_df
+        return [Task(LEAF, 'player', ('player', url), (target, team, k, url))
+                for k, url in enumerate(player_links)]
+
+    def task_player(self, target, team, k, url):
+        self.positions[target, team, k] = get_vnl_data.get_position(url)
+
+    def task_schedule(self, season):
+        schedule = get_vnl_data.get_schedule(season)
+        genders, _ = split_matchname(schedule['matchname'])
+        tasks = []
+        for target in self.targets:
+            if target.season != season:
+                continue
+            target_schedule = schedule[genders == target.gender].reset_index(drop=True)
+            self.schedules[target] = target_schedule
+            tasks.extend(Task(LEAF, 'match', ('match', season, matchid), (season, matchid))
+                         for matchid in target_schedule['matchid'])
+        return tasks
+
+    def task_match(self, season, matchid):
+        self.matches[season, matchid] = get_vnl_data.get_one_match_data(matchid, season)
+
+    def datasets(self):
+        """
+        Yield (target, dataset, df) for everything collected, with rows in
+        page order.
+        """
+        for (target, name), df in self.tables.items():
+            yield target, name, df
+        for target in self.targets:
+            teams = [(team, self.rosters[target, team]) for team in self.teams.get(target, [])
+                     if (target, team) in self.rosters]
+            if teams:
+                for team, df in teams:
+                    df['position'] = [self.positions.get((target, team, k))
+                                      for k in range(len(df))]
+                yield target, 'player_bio', pd.concat(df for _, df in teams)
+            if target in self.schedules:
+                schedule = self.schedules[target]
+                yield target, 'schedule', schedule
+                matches = [self.matches[key] for key in
+                           ((target.season, matchid) for matchid in schedule['matchid'])
+                           if key in self.matches]
+                if matches:
+                    yield target, 'matches', pd.concat(matches)
+
+
+def crawl(targets, max_workers=get_vnl_data.MAX_WORKERS):
+    """
+    Crawl every target on one pool of max_workers threads and return the
+    Crawl with the collected frames. Pages that fail are reported and
+    skipped, e.g. the roster of a team missing from TEAM_ABBRS.
+    """
+    state = Crawl(targets)
+    frontier = Frontier()
+    for task in seed_tasks(targets):
+        frontier.push(task)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier or running:
+            while frontier and len(running) < max_workers:
+                task = frontier.pop()
+                running[executor.submit(state.run_task, task)] = task
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    new_tasks = future.result()
+                except Exception as e:
+                    print('failed %s %s: %r' % (task.kind, task.key, e))
+                    state.failed.append((task, e))
+                    continue
+                for new_task in new_tasks:
+                    frontier.push(new_task)
+    return state
+
+
+def save_crawl(state, out_dir):
+    """
+    Save every dataset as <dataset>_<season>_<gender>.csv in out_dir.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for (season, gender), name, df in state.datasets():
+        fname = os.path.join(out_dir, '%s_%d_%s.csv' % (name, season, gender))
+        df.to_csv(fname, index=False)
+        print(fname + ' saved.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawl several VNL seasons and genders.')
+    parser.add_argument('targets', nargs='+', type=parse_target, metavar='SEASON/GENDER',
+                        help='e.g. 2019/women 2021/men')
+    parser.add_argument('--out', default='./', help='directory for the csv files')
+    parser.add_argument('--workers', type=int, default=get_vnl_data.MAX_WORKERS,
+                        help='pages fetched at the same time across all targets')
+    parser.add_argument('--parse-processes', type=int,
+                        help='parse match and table pages in this many worker processes')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='add every fetched page, also from the cache, to the page archive in DIR')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the on-disk page cache')
+    parser.add_argument('--replay', metavar='DIR',
+                        help='read every page from the archive in DIR instead of the network')
+    args = parser.parse_args()
+    get_vnl_data.PARSE_PROCESSES = args.parse_processes
+    if args.archive:
+        vnl_http.ARCHIVE = PageArchive(args.archive)
+    if args.no_cache:
+        vnl_http.CACHE = None
+    if args.replay:
+        vnl_http.replay(PageArchive(args.replay))
+    get_vnl_data.get_parse_pool()
+    try:
+        state = crawl(args.targets, args.workers)
+    finally:
+        get_vnl_data.close_parse_pool()
+    save_crawl(state, args.out)
+    if state.failed:
+        print('%d pages failed' % len(state.failed))
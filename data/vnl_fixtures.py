@@ -0,0 +1,245 @@
+"""
+HTML fixtures of every page type the scraper reads, for offline benchmarks.
+
+Pages recorded from the real site with record_fixtures() are used when they
+exist in the fixture directory. Any other page is rebuilt from the stored
+CSVs with the same markup the scraper expects, so a full run can be replayed
+without network access.
+"""
+import csv
+import html
+import os
+import re
+from collections import defaultdict
+from urllib.parse import quote, urlsplit
+
+import get_vnl_data
+from get_vnl_data import BEST_PLAYERS, MATCH_TABLES, TEAM_TO_ABBR
+from vnl_http import fetch
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(DATA_DIR, 'bench_fixtures')
+
+SITE = 'https://en.volleyballworld.com'
+STATS_PATH = '/en/vnl/2019/women/statistics/'
+ROUND1_PATH = '/en/vnl/2019/women/resultsandranking/round1'
+ROSTER_PATH = '/en/vnl/2019/women/teams/%s-%s/team_roster'
+PLAYER_PATH = '/en/vnl/2019/women/teams/%s-%s/players/%d'
+SCHEDULE_PATH = '/volleyball/competitions/vnl-2021/schedule/'
+MATCH_PATH = '/volleyball/competitions/vnl-2021/schedule/%s/_libraries/_finished-match'
+
+_ROSTER_RE = re.compile(r'^/en/vnl/2019/women/teams/([a-z]+)-([a-z ]+)/team_roster$')
+_PLAYER_RE = re.compile(r'^/en/vnl/2019/women/teams/([a-z]+)-([a-z ]+)/players/(\d+)$')
+_MATCH_RE = re.compile(r'^/volleyball/competitions/vnl-2021/schedule/(\d+)/_libraries/_finished-match$')
+
+BIO_COLUMNS = ['name', 'birthdate', 'height', 'weight', 'spike', 'block',
+               'world_championships', 'olympic_games', 'other', 'total', 'club']
+
+
+def read_rows(filename):
+    with open(os.path.join(DATA_DIR, filename), newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def _table(head_rows, body_rows, attrs=''):
+    thead = ''.join('<tr>%s</tr>' % ''.join('<th>%s</th>' % h for h in row) for row in head_rows)
+    tbody = ''.join('<tr>%s</tr>' % ''.join('<td>%s</td>' % c for c in row) for row in body_rows)
+    return '<table%s><thead>%s</thead><tbody>%s</tbody></table>' % (attrs, thead, tbody)
+
+
+def _page(body):
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>VNL</title></head>'
+            '<body>%s</body></html>' % body)
+
+
+def _spans(value):
+    # Scores such as '23-25' are shown as one span per team
+    if value == '-':
+        return value
+    return ''.join('<span>%s</span>' % part for part in value.split('-'))
+
+
+def statistics_page():
+    tables = []
+    for name in BEST_PLAYERS:
+        with open(os.path.join(DATA_DIR, name + '.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        head = [h.replace('_', ' ').title() for h in rows[0]]
+        body = [[html.escape(c) for c in row] for row in rows[1:]]
+        body.append(['Total'] + [''] * (len(head) - 1))
+        tables.append('<h2>%s</h2>%s' % (name, _table([head], body)))
+    return _page(''.join(tables))
+
+
+def _set_score(r, i):
+    # '-' for a set that was not played
+    if not r['set%d_home' % i]:
+        return '-'
+    return r['set%d_home' % i] + '-' + r['set%d_away' % i]
+
+
+def round1_page():
+    head1 = ['Rank', 'Team', '', 'Matches', 'Results', 'Points', 'Sets', 'Points']
+    head2 = ['Total', 'Won', 'Lost', '3-0', '3-1', '3-2', '2-3', '1-3', '0-3',
+             'Points', 'Won', 'Lost', 'Ratio', 'Won', 'Lost', 'Ratio']
+    cols = ['match_total', 'match_win', 'match_lose', '3-0', '3-1', '3-2', '2-3', '1-3', '0-3',
+            'points', 'set_won', 'set_lost', 'set_ratio', 'point_won', 'point_lost', 'point_ratio']
+    body = [[r['rank'], r['team_full'], '<img src="flag.png">'] + [r[c] for c in cols]
+            for r in read_rows('team_rank.csv')]
+    ranking = _table([head1, head2], body)
+
+    body = [[r['number'], r['date'], _spans(r['teams']), _spans(r['sets'])] +
+            [_spans(_set_score(r, i)) for i in range(1, 6)] +
+            [_spans(r['pionts']), r['time'], r['audience']]
+            for r in read_rows('round_robin.csv')]
+    head = ['No', 'Date', 'Teams', 'Sets', 'Set 1', 'Set 2', 'Set 3', 'Set 4', 'Set 5',
+            'Points', 'Time', 'Audience']
+    return _page(ranking + _table([head], body))
+
+
+def team_players(abbr):
+    return [r for r in read_rows('player_bio.csv') if r['team'] == abbr.upper()]
+
+
+def roster_page(abbr, team):
+    head = ['No.'] + [c.replace('_', ' ').title() for c in BIO_COLUMNS]
+    body = []
+    for k, player in enumerate(team_players(abbr)):
+        row = [str(k + 1)]
+        for c in BIO_COLUMNS:
+            value = html.escape(player[c])
+            if c == 'name':
+                value = '<a href="%s">%s</a>' % (PLAYER_PATH % (abbr, team, k), value)
+            row.append('\n  %s  ' % value)
+        body.append(row)
+    return _page(_table([head], body, ' class="roster"'))
+
+
+def player_page(abbr, k):
+    player = team_players(abbr)[k]
+    return _page('<div class="col-1-3"><ul><li><span>Position</span><span> %s </span></li>'
+                 '<li><span>Height</span><span>%s</span></li></ul></div>'
+                 '<div class="col-1-3"><p>%s</p></div>'
+                 % (html.escape(player['position']), player['height'], html.escape(player['club'])))
+
+
+def schedule_page(limit=None):
+    matches = []
+    for r in read_rows('schedule2021.csv')[:limit]:
+        # The site shows home, '-', away for every played set
+        spans = []
+        for i in range(1, 6):
+            if r['set%d_home' % i]:
+                spans += [r['set%d_home' % i], '-', r['set%d_away' % i]]
+        matches.append(
+            '<div class="vbw-mu--match vbw-mu-finished vbw-mu" matchid="vnl2021-%s"><a href="#"><div>'
+            '<div class="vbw-mu__info--details">%s</div>'
+            '<div><div class="vbw-mu__team__name vbw-mu__team__name--abbr">%s</div>'
+            '<div><div class="vbw-mu__score vbw-mu__score--home">%s</div></div></div>'
+            '<div><div class="vbw-mu__team__name vbw-mu__team__name--abbr">%s</div>'
+            '<div><div class="vbw-mu__score vbw-mu__score--away">%s</div></div></div>'
+            '<div class="vbw-mu__sets--result">%s</div></div></a></div>'
+            % (r['matchid'], html.escape(r['matchname']), r['teamhome'], r['scorehome'],
+               r['teamaway'], r['awayhome'], ''.join('<span>%s</span>' % s for s in spans)))
+    matches.append('<div class="vbw-mu--match vbw-mu-upcoming vbw-mu" matchid="vnl2021-99999"></div>')
+    return _page(''.join(matches))
+
+
+_match_rows = None
+
+
+def match_rows():
+    global _match_rows
+    if _match_rows is None:
+        _match_rows = defaultdict(list)
+        for r in read_rows('matches2021.csv'):
+            _match_rows[r['schedule_id']].append(r)
+    return _match_rows
+
+
+def match_page(matchid):
+    rows = match_rows()[matchid]
+    teams = []
+    for r in rows:
+        if r['nationality'] not in teams:
+            teams.append(r['nationality'])
+    links = ''.join('<li><a href="#team%d"><div class="vbw-mu__team__name vbw-mu__team__name--abbr">%s</div></a></li>'
+                    % (i, team) for i, team in enumerate(teams))
+    out = ['<section><div><div><div><div><div><div><div><ul>%s</ul>'
+           '</div></div></div></div></div></div></div></section>' % links]
+    # The real page repeats every table for each set
+    for set_name in ['all', '1', '2', '3', '4', '5']:
+        for i, team in enumerate(teams):
+            for kind, row_class, cells in MATCH_TABLES:
+                out.append('<table class="vbw-o-table vbw-match-player-statistic-table vbw-stats-%s vbw-set-%s" '
+                           'data-team="team%d"><thead><tr>%s</tr></thead><tbody>'
+                           % (kind, set_name, i, ''.join('<th>%s</th>' % c for c, _ in cells)))
+                for r in rows:
+                    if r['nationality'] != team:
+                        continue
+                    # Missing efficiencies are empty cells
+                    tds = ''.join('<td class="vbw-o-table__cell %s">%s</td>'
+                                  % (c, html.escape(r[col]) if r[col].strip() else '')
+                                  for c, col in cells)
+                    out.append('<tr class="%s">%s</tr>' % (row_class, tds))
+                out.append('<tr class="vbw-o-table__row vbw-o-table__row--total"><td>Total</td></tr></tbody></table>')
+    return _page(''.join(out))
+
+
+def fixture_path(path, fixture_dir=FIXTURE_DIR):
+    return os.path.join(fixture_dir, quote(path, safe='') + '.html')
+
+
+def build_page(path, schedule_limit=None):
+    """
+    Return the synthetic page for a site path, or None if there is none.
+    """
+    if path == STATS_PATH:
+        return statistics_page()
+    if path == ROUND1_PATH:
+        return round1_page()
+    if path == SCHEDULE_PATH:
+        return schedule_page(schedule_limit)
+    m = _ROSTER_RE.match(path)
+    if m and TEAM_TO_ABBR.get(m.group(2)) == m.group(1):
+        return roster_page(m.group(1), m.group(2))
+    m = _PLAYER_RE.match(path)
+    if m and int(m.group(3)) < len(team_players(m.group(1))):
+        return player_page(m.group(1), int(m.group(3)))
+    m = _MATCH_RE.match(path)
+    if m and m.group(1) in match_rows():
+        return match_page(m.group(1))
+    return None
+
+
+def load_page(path, fixture_dir=FIXTURE_DIR, schedule_limit=None):
+    """
+    Return the page body for a site path as bytes, preferring recorded pages.
+    """
+    fname = fixture_path(path, fixture_dir)
+    if os.path.exists(fname):
+        with open(fname, 'rb') as f:
+            return f.read()
+    page = build_page(path, schedule_limit)
+    return None if page is None else page.encode('utf-8')
+
+
+def record_fixtures(fixture_dir=FIXTURE_DIR, max_matches=None):
+    """
+    Download one copy of every page type from the real site into fixture_dir.
+    """
+    urls = [SITE + STATS_PATH, SITE + ROUND1_PATH, SITE + SCHEDULE_PATH]
+    for team, abbr in TEAM_TO_ABBR.items():
+        roster_url = SITE + ROSTER_PATH % (abbr, team)
+        urls.append(roster_url)
+        urls.extend(get_vnl_data.get_player_href(roster_url))
+    tree = get_vnl_data.parse_tree(fetch(SITE + SCHEDULE_PATH))
+    matchids = [m[-5:] for m in tree.xpath("//div[@class='vbw-mu--match vbw-mu-finished vbw-mu']/@matchid")]
+    urls.extend(SITE + MATCH_PATH % matchid for matchid in matchids[:max_matches])
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    for url in urls:
+        response = fetch(url)
+        with open(fixture_path(urlsplit(url).path, fixture_dir), 'wb') as f:
+            f.write(response.content)
+    print('%d pages recorded in %s' % (len(urls), fixture_dir))
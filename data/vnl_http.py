@@ -0,0 +1,303 @@
+"""
+Shared HTTP client used by every fetch in get_vnl_data.py.
+
+All requests go through one requests.Session, so connections to
+en.volleyballworld.com are kept alive and reused from a per-host pool.
+Failed requests (connection errors, timeouts and 5xx responses) are retried
+with jittered exponential backoff. Requests to each host are spaced by the
+token-bucket LIMITER, which also slows down when the server answers 429/503.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import vnl_metrics
+from vnl_cache import ResponseCache
+from vnl_ratelimit import RateLimiter, THROTTLE_STATUSES, retry_after
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0',}
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 30)
+# Connections kept open per host; keep it at least as large as MAX_WORKERS
+POOL_SIZE = 16
+RETRIES = 5
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+# 429 and 503 are retried by fetch() through the rate limiter instead
+RETRY_STATUSES = (500, 502, 504)
+# Bytes handed to incremental parsers at a time, see fetch_stream()
+CHUNK_SIZE = 64 * 1024
+
+# Shared on-disk page cache; set to None to always go to the network
+CACHE = ResponseCache()
+# vnl_archive.PageArchive every downloaded page is added to, or None
+ARCHIVE = None
+# Archive every fetch is answered from instead of the network, see replay()
+REPLAY = None
+REPLAY_AS_OF = None
+# Per-host rate limit; set to None to send requests as fast as they come
+LIMITER = RateLimiter()
+
+_session = None
+
+
+def make_session(pool_size=POOL_SIZE, retries=RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 backoff_jitter=BACKOFF_JITTER, headers=HEADERS):
+    """
+    Build a session with a keep-alive connection pool and retry policy.
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=backoff_factor, backoff_jitter=backoff_jitter,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=['GET'],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+def configure(**kwargs):
+    """
+    Replace the shared session, e.g. configure(pool_size=32, retries=2).
+    """
+    global _session
+    _session = make_session(**kwargs)
+    return _session
+
+
+def replay(archive, as_of=None):
+    """
+    Answer every fetch from the pages in archive, as they were at time
+    as_of (default: the latest copy), without touching the network.
+    replay(None) goes back to the network.
+    """
+    global REPLAY, REPLAY_AS_OF
+    REPLAY = archive
+    REPLAY_AS_OF = as_of
+
+
+def set_rate_limit(rate, burst=None):
+    """
+    Allow rate requests per second to each host; None or 0 turns it off.
+    """
+    global LIMITER
+    LIMITER = RateLimiter(rate, burst or max(1, int(rate))) if rate else None
+    return LIMITER
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = make_session()
+    return _session
+
+
+def _get(url, headers, timeout, stream=False):
+    # With stream the body is left unread, for the caller to iterate
+    for attempt in range(RETRIES + 1):
+        if LIMITER is not None:
+            with vnl_metrics.timer('rate_limit_wait'):
+                LIMITER.wait(url)
+        with vnl_metrics.timer('network'):
+            html = get_session().get(url, headers=headers, timeout=timeout, stream=stream)
+        vnl_metrics.count('requests')
+        if not stream:
+            vnl_metrics.count('bytes', len(html.content))
+        if LIMITER is not None:
+            LIMITER.update(url, html)
+        if html.status_code not in THROTTLE_STATUSES or attempt == RETRIES:
+            break
+        vnl_metrics.count('throttled')
+        html.close()
+        if LIMITER is None:
+            delay = retry_after(html)
+            time.sleep(delay if delay is not None else BACKOFF_FACTOR * 2 ** attempt)
+    if html.status_code != 200:
+        vnl_metrics.count('status_%d' % html.status_code)
+    return html
+
+
+def archive_page(url, response):
+    """
+    Add a page to ARCHIVE unless its latest archived copy has the same body.
+    """
+    if ARCHIVE is None or response.status_code != 200:
+        return
+    latest = ARCHIVE.lookup(url)
+    if latest is None or latest.content != response.content:
+        ARCHIVE.append(url, response)
+        vnl_metrics.count('archived')
+
+
+def fetch(url, headers=None, timeout=TIMEOUT):
+    """
+    Get the page at url, going to the network only if there is no fresh copy
+    in CACHE. Stale copies are revalidated with ETag/Last-Modified.
+    Every page is added to ARCHIVE, wherever it came from.
+    Raises requests.HTTPError if the page still fails after the retries.
+    """
+    if REPLAY is not None:
+        response = REPLAY.lookup(url, REPLAY_AS_OF)
+        if response is None:
+            raise LookupError('%s is not in the archive' % url)
+        vnl_metrics.count('archive_hits')
+        return response
+    response = _fetch(url, headers, timeout)
+    archive_page(url, response)
+    return response
+
+
+def _fetch(url, headers, timeout):
+    if CACHE is None:
+        html = _get(url, headers, timeout)
+        html.raise_for_status()
+        return html
+    cached = CACHE.lookup(url, headers)
+    request_headers = dict(headers or {})
+    if cached is not None:
+        response, fresh, validators = cached
+        if fresh:
+            vnl_metrics.count('cache_hits')
+            return response
+        request_headers.update(validators)
+    html = _get(url, request_headers, timeout)
+    if html.status_code == 304 and cached is not None:
+        vnl_metrics.count('cache_revalidated')
+        CACHE.revalidated(url, headers)
+        return response
+    if html.status_code != 200:
+        html.raise_for_status()
+        return html
+    return CACHE.store(url, headers, html)
+
+
+def iter_chunks(content, chunk_size=CHUNK_SIZE):
+    """
+    Yield content in pieces of at most chunk_size bytes.
+    """
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
+
+
+def _timed_chunks(chunks, name):
+    """
+    Yield the chunks of an iterator, timing every read under timer name
+    rather than in the timer of the code that consumes them.
+    """
+    chunks = iter(chunks)
+    while True:
+        with vnl_metrics.timer(name):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _stream_chunks(html, chunk_size):
+    with html:
+        for chunk in _timed_chunks(html.iter_content(chunk_size), 'network'):
+            vnl_metrics.count('bytes', len(chunk))
+            yield chunk
+
+
+def fetch_stream(url, headers=None, timeout=TIMEOUT, chunk_size=CHUNK_SIZE):
+    """
+    Get the page at url as (encoding, iterator over chunks of its body),
+    like fetch() but without holding the whole body: it is read from the
+    network or the CACHE file while the chunks are consumed, and a
+    downloaded page is written to the cache as it goes. Pages for REPLAY
+    or ARCHIVE come from fetch() and are handed out in chunks.
+    """
+    if REPLAY is not None or ARCHIVE is not None:
+        html = fetch(url, headers, timeout)
+        return html.encoding, iter_chunks(html.content, chunk_size)
+    cached = None
+    request_headers = dict(headers or {})
+    if CACHE is not None:
+        cached = CACHE.lookup(url, headers, stream=True)
+        if cached is not None:
+            response, fresh, validators = cached
+            if fresh:
+                vnl_metrics.count('cache_hits')
+                return response.encoding, _timed_chunks(response.iter_content(chunk_size),
+                                                        'cache_read')
+            request_headers.update(validators)
+    html = _get(url, request_headers, timeout, stream=True)
+    if html.status_code == 304 and cached is not None:
+        html.close()
+        vnl_metrics.count('cache_revalidated')
+        CACHE.revalidated(url, headers)
+        return response.encoding, _timed_chunks(response.iter_content(chunk_size), 'cache_read')
+    if cached is not None:
+        # The stale copy is not used
+        response.close()
+    if html.status_code != 200:
+        html.close()
+        html.raise_for_status()
+    chunks = _stream_chunks(html, chunk_size)
+    if CACHE is not None:
+        chunks = CACHE.store_stream(url, headers, html, chunks)
+    return html.encoding, chunks
+
+
+class PageRegistry:
+    """
+    Per-run memo of fetched and parsed pages.
+
+    get(url, parse) fetches url once and parses it once per parse function;
+    a thread asking for a page another thread is already fetching or parsing
+    waits for that result instead of issuing its own request.
+    """
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _once(self, key, func):
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        if owner:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                # Let a later call try again
+                with self._lock:
+                    del self._results[key]
+                future.set_exception(e)
+        return future.result()
+
+    def fetch(self, url):
+        return self._once(url, lambda: fetch(url))
+
+    def memo(self, key, func):
+        """
+        Return func(), computed once per run for key.
+        """
+        return self._once(key, func)
+
+    def get(self, url, parse):
+        return self._once((url, parse), lambda: parse(self.fetch(url)))
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+# Pages shared by several scraper functions within one run
+PAGES = PageRegistry()
+
+
+def get_page(url, parse):
+    """
+    Return parse(response) for url, fetching and parsing it once per run.
+    """
+    return PAGES.get(url, parse)
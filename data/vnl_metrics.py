@@ -0,0 +1,163 @@
+"""
+Per-stage instrumentation for the scraping pipeline.
+
+main() runs every stage inside stage(name). While a stage is active the
+fetch and parse code adds to its counters with count() and timer(), and
+write_report() saves all finished stages as JSON. Times recorded with
+timer() are summed over all worker threads, so with a thread pool they can
+add up to more than the wall time of the stage. A timer nested in another
+on the same thread takes its time out of the outer one, e.g. the network
+reads of a page parsed while it streams in.
+"""
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Finished stages, in the order they ran
+STAGES = []
+
+_current = None
+_lock = threading.Lock()
+# Per thread: time spent in the timers nested in each open timer
+_nested = threading.local()
+
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.counters = defaultdict(int)
+        self.times = defaultdict(float)
+        self.wall = 0.0
+        self.extra = {}
+
+    def as_dict(self):
+        rows = self.counters.get('rows', 0)
+        report = {'stage': self.name,
+                  'wall_s': round(self.wall, 4),
+                  'requests': self.counters.get('requests', 0),
+                  'bytes_downloaded': self.counters.get('bytes', 0),
+                  'cache_hits': self.counters.get('cache_hits', 0),
+                  'network_s': round(self.times.get('network', 0.0), 4),
+                  'parse_s': round(self.times.get('parse', 0.0), 4),
+                  'dataframe_s': round(self.times.get('dataframe', 0.0), 4),
+                  'rows': rows,
+                  'rows_per_s': round(rows / self.wall, 2) if self.wall else None,
+                  'counters': dict(self.counters),
+                  'times': {name: round(t, 4) for name, t in self.times.items()}}
+        report.update(self.extra)
+        return report
+
+
+def count(name, n=1):
+    """
+    Add n to a counter of the running stage.
+    """
+    stage_metrics = _current
+    if stage_metrics is not None:
+        with _lock:
+            stage_metrics.counters[name] += n
+
+
+@contextmanager
+def timer(name):
+    """
+    Add the time spent in the with block to a timer of the running stage,
+    less the time of timers nested in it.
+    """
+    if not hasattr(_nested, 'stack'):
+        _nested.stack = []
+    _nested.stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _nested.stack.pop()
+        if _nested.stack:
+            _nested.stack[-1] += elapsed
+        stage_metrics = _current
+        if stage_metrics is not None:
+            with _lock:
+                stage_metrics.times[name] += elapsed - nested
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the whole process since it started, in MB.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@contextmanager
+def stage(name, profile=False, trace_memory=False, top=20):
+    """
+    Collect metrics for one pipeline stage.
+
+    profile runs the stage under cProfile (main thread only) and keeps the
+    top functions by cumulative time; trace_memory uses tracemalloc to keep
+    the peak of Python allocations and the top allocation sites.
+
+    The OS only reports the peak memory of the whole process, so a stage
+    records that peak as of its end (process_peak_rss_mb) and how far the
+    stage raised it (peak_rss_growth_mb), which is 0 for a stage that stayed
+    below the peak of an earlier one.
+    """
+    global _current
+    stage_metrics = StageMetrics(name)
+    peak_before = peak_rss_mb()
+    _current = stage_metrics
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield stage_metrics
+    finally:
+        stage_metrics.wall = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+            stage_metrics.extra['profile'] = out.getvalue().splitlines()
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            stage_metrics.extra['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            stage_metrics.extra['tracemalloc_top'] = [
+                str(stat) for stat in snapshot.statistics('lineno')[:top]]
+            tracemalloc.stop()
+        peak_after = peak_rss_mb()
+        stage_metrics.extra['process_peak_rss_mb'] = peak_after
+        if peak_after is not None:
+            stage_metrics.extra['peak_rss_growth_mb'] = round(peak_after - peak_before, 1)
+        _current = None
+        STAGES.append(stage_metrics)
+
+
+def write_report(fname):
+    """
+    Save the metrics of every finished stage as JSON.
+    """
+    report = {'stages': [stage_metrics.as_dict() for stage_metrics in STAGES],
+              'total_wall_s': round(sum(s.wall for s in STAGES), 4),
+              'peak_rss_mb': peak_rss_mb()}
+    with open(fname, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(fname + ' saved.')
+    return report
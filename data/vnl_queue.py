@@ -0,0 +1,369 @@
+"""
+Work queue of the scraper in a sqlite file, shared by any number of worker
+processes on this or other hosts.
+
+Roster pages, player pages and match IDs are put on the queue as items.
+A worker leases a few items at a time, fetches and parses them on its
+threads and acknowledges each one with its result. A lease expires after
+VISIBILITY_TIMEOUT seconds, so the items of a worker that died are handed
+to another worker. The results are turned into the usual csv files by the
+collect command:
+
+    python vnl_queue.py enqueue bio matches-2021 --db queue.sqlite
+    python vnl_queue.py work --db queue.sqlite --processes 4
+    python vnl_queue.py status --db queue.sqlite
+    python vnl_queue.py collect bio matches-2021 --db queue.sqlite --out-dir ./
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import get_vnl_data
+import vnl_http
+import vnl_ratelimit
+from vnl_archive import PageArchive
+
+QUEUE_DB = 'vnl_queue.sqlite'
+# Seconds a leased item stays invisible to other workers
+VISIBILITY_TIMEOUT = 300
+# Leases of an item before it is marked failed
+MAX_ATTEMPTS = 3
+# Seconds a worker waits before looking for items again
+POLL_INTERVAL = 1.0
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+# Index pages are leased before the pages they link to
+INDEX, LEAF = 0, 1
+
+# Stages that can be run through the queue
+STAGES = ['bio', 'matches-2021']
+
+# owner is the worker the item was leased to
+Item = namedtuple('Item', ['id', 'queue', 'key', 'payload', 'owner'])
+
+
+class WorkQueue:
+    """
+    Items to process, keyed by (queue, key), with leases and results.
+    Every process opens its own WorkQueue on the shared file.
+    """
+    def __init__(self, path=QUEUE_DB):
+        self.path = path
+        # Transactions are opened explicitly, see _transaction()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY, queue TEXT, key TEXT, payload TEXT,
+            priority INTEGER, state TEXT, owner TEXT, lease_until REAL,
+            attempts INTEGER, error TEXT, result TEXT, UNIQUE (queue, key))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, priority, id)")
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock at once, so two workers
+        # cannot lease the same item
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def _put(self, conn, queue, key, payload, priority):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO items (queue, key, payload, priority, state, lease_until, attempts)"
+            " VALUES (?, ?, ?, ?, ?, 0, 0)", (queue, key, json.dumps(payload), priority, PENDING))
+        return cursor.rowcount
+
+    def put(self, items):
+        """
+        Add (queue, key, payload, priority) items; items whose key is
+        already on the queue are left as they are. Return how many were added.
+        """
+        conn = self._transaction()
+        try:
+            added = sum(self._put(conn, *item) for item in items)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def lease(self, owner, n, visibility=VISIBILITY_TIMEOUT):
+        """
+        Lease up to n pending items, or items whose lease expired, to owner.
+        """
+        now = time.time()
+        conn = self._transaction()
+        try:
+            # Items that keep killing their workers are given up
+            conn.execute("UPDATE items SET state = ?, error = 'lease expired' "
+                         "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                         (FAILED, LEASED, now, MAX_ATTEMPTS))
+            rows = conn.execute(
+                "SELECT id, queue, key, payload FROM items WHERE state = ? "
+                "OR (state = ? AND lease_until < ?) ORDER BY priority, id LIMIT ?",
+                (PENDING, LEASED, now, n)).fetchall()
+            conn.executemany(
+                "UPDATE items SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ?", [(LEASED, owner, now + visibility, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [Item(id, queue, key, json.loads(payload), owner)
+                for id, queue, key, payload in rows]
+
+    def ack(self, item, result, new_items=()):
+        """
+        Store the result of a leased item and add the items it found.
+        Return False, and store nothing, if the lease of item.owner expired
+        and the item was leased to another worker meanwhile.
+        """
+        conn = self._transaction()
+        try:
+            acked = conn.execute("UPDATE items SET state = ?, result = ?, error = NULL "
+                                 "WHERE id = ? AND state = ? AND owner = ?",
+                                 (DONE, result, item.id, LEASED, item.owner)).rowcount
+            if acked:
+                for new_item in new_items:
+                    self._put(conn, *new_item)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return bool(acked)
+
+    def fail(self, item, error):
+        """
+        Give a leased item back after an error, or mark it failed once it
+        has been tried MAX_ATTEMPTS times. Return False if item.owner no
+        longer holds the lease.
+        """
+        return bool(self._conn.execute(
+            "UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+            "lease_until = 0, error = ? WHERE id = ? AND state = ? AND owner = ?",
+            (MAX_ATTEMPTS, FAILED, PENDING, error, item.id, LEASED, item.owner)).rowcount)
+
+    def counts(self):
+        """
+        Number of items by queue and state.
+        """
+        rows = self._conn.execute("SELECT queue, state, COUNT(*) FROM items GROUP BY queue, state")
+        return {(queue, state): n for queue, state, n in rows}
+
+    def unfinished(self):
+        return self._conn.execute("SELECT COUNT(*) FROM items WHERE state IN (?, ?)",
+                                  (PENDING, LEASED)).fetchone()[0]
+
+    def results(self, queue):
+        """
+        Yield (payload, result) for the done items of a queue, in the order
+        they were added.
+        """
+        rows = self._conn.execute("SELECT payload, result FROM items WHERE queue = ? AND state = ? "
+                                  "ORDER BY id", (queue, DONE))
+        for payload, result in rows:
+            yield json.loads(payload), result
+
+    def close(self):
+        self._conn.close()
+
+
+def roster_item(season, gender, team):
+    return ('roster', '%d/%s/%s' % (season, gender, team),
+            {'season': season, 'gender': gender, 'team': team}, INDEX)
+
+
+def match_item(season, matchid):
+    return ('match', '%d/%s' % (season, matchid), {'season': season, 'matchid': matchid}, LEAF)
+
+
+def process_roster(payload):
+    player_df, player_links = get_vnl_data.get_team_roster(
+        payload['team'], payload['season'], payload['gender'])
+    result = json.dumps({'roster': player_df.to_csv(index=False), 'links': player_links})
+    return result, [('player', url, {'url': url}, LEAF) for url in player_links]
+
+
+def process_player(payload):
+    return get_vnl_data.get_position(payload['url']), []
+
+
+def process_match(payload):
+    df = get_vnl_data.get_one_match_data(payload['matchid'], payload['season'])
+    return df.to_csv(index=False), []
+
+
+# Queue name -> function of the payload returning (result, new items)
+PROCESSORS = {'roster': process_roster, 'player': process_player, 'match': process_match}
+
+
+def work(path=QUEUE_DB, threads=get_vnl_data.MAX_WORKERS, owner=None):
+    """
+    Process items of the queue in path on threads threads until every item
+    is done or failed. Return the number of items this worker processed.
+    """
+    owner = owner or '%s:%d' % (socket.gethostname(), os.getpid())
+    queue = WorkQueue(path)
+    running = {}
+    processed = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            # Lease only what the threads can start now, so no item waits
+            # out its lease in this worker
+            if len(running) < threads:
+                for item in queue.lease(owner, threads - len(running)):
+                    running[executor.submit(PROCESSORS[item.queue], item.payload)] = item
+            if not running:
+                # Other workers may still add items or die holding some
+                if not queue.unfinished():
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            done, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = running.pop(future)
+                try:
+                    result, new_items = future.result()
+                except Exception as e:
+                    print('failed %s %s: %r' % (item.queue, item.key, e))
+                    if not queue.fail(item, repr(e)):
+                        print('lease of %s %s was lost' % (item.queue, item.key))
+                    continue
+                if not queue.ack(item, result, new_items):
+                    # Another worker holds the item now and stores its result
+                    print('lease of %s %s was lost' % (item.queue, item.key))
+                    continue
+                processed += 1
+    queue.close()
+    get_vnl_data.close_parse_pool()
+    print('%s processed %d items' % (owner, processed))
+    return processed
+
+
+def run_workers(path=QUEUE_DB, processes=1, threads=get_vnl_data.MAX_WORKERS):
+    """
+    Run processes worker processes on the queue in path and wait for them.
+    """
+    if processes == 1:
+        work(path, threads)
+        return
+    workers = [multiprocessing.Process(target=work, args=(path, threads))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def enqueue(queue, stages, out_dir='./'):
+    """
+    Put the pages of the given stages on the queue.
+    """
+    items = []
+    if 'bio' in stages:
+        items += [roster_item(2019, 'women', team) for team in get_vnl_data.TEAMS['women']]
+    if 'matches-2021' in stages:
+        items += [match_item(2021, matchid) for matchid in get_vnl_data.read_matchids_2021(out_dir)]
+    print('%d of %d items added' % (queue.put(items), len(items)))
+
+
+def collect_bio(queue, out_dir='./', parquet_dir=None, sqlite_db=None):
+    """
+    Save player_bio.csv from the roster and player results, in the team
+    order of TEAMS and the roster order.
+    """
+    rosters = {(p['season'], p['gender'], p['team']): json.loads(result)
+               for p, result in queue.results('roster')}
+    positions = {p['url']: result for p, result in queue.results('player')}
+    teams = []
+    for team in get_vnl_data.TEAMS['women']:
+        if (2019, 'women', team) not in rosters:
+            print('roster of %s is missing' % team)
+            continue
+        roster = rosters[2019, 'women', team]
+        player_df = pd.read_csv(io.StringIO(roster['roster']), dtype=object)
+        player_df['position'] = [positions.get(url) for url in roster['links']]
+        teams.append(player_df)
+    get_vnl_data.save_csv(pd.concat(teams), 'player_bio.csv', out_dir, parquet_dir,
+                          sqlite_db=sqlite_db)
+
+
+def collect_matches(queue, out_dir='./', parquet_dir=None, incremental=False, sqlite_db=None):
+    """
+    Save matches2021.csv and the season totals from the match results, in
+    the order of the stored schedule.
+    """
+    frames = {p['matchid']: result for p, result in queue.results('match') if p['season'] == 2021}
+
+    def source(todo):
+        for matchid in todo:
+            if matchid not in frames:
+                print('match %s is missing' % matchid)
+                continue
+            yield matchid, get_vnl_data.read_matches_2021(io.StringIO(frames[matchid]))
+
+    get_vnl_data.get_matches_data_2021(get_vnl_data.read_matchids_2021(out_dir),
+                                       incremental=incremental, out_dir=out_dir,
+                                       parquet_dir=parquet_dir, source=source,
+                                       sqlite_db=sqlite_db)
+
+
+def print_status(queue):
+    for (name, state), n in sorted(queue.counts().items()):
+        print('%-8s %-8s %d' % (name, state, n))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrape through a work queue shared by several workers.')
+    parser.add_argument('command', choices=['enqueue', 'work', 'status', 'collect'])
+    parser.add_argument('stages', nargs='*', metavar='STAGE',
+                        help='bio or matches-2021, the stages to enqueue or collect (default: both)')
+    parser.add_argument('--db', default=QUEUE_DB, help='sqlite file of the queue')
+    parser.add_argument('--out-dir', default='./', help='directory for the csv files')
+    parser.add_argument('--parquet-dir', metavar='DIR',
+                        help='also write partitioned Parquet datasets under DIR')
+    parser.add_argument('--sqlite', metavar='DB',
+                        help='also upsert the collected datasets into the indexed sqlite store DB')
+    parser.add_argument('--incremental', action='store_true',
+                        help='append the collected matches missing from matches2021.csv')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes to start')
+    parser.add_argument('--threads', type=int, default=get_vnl_data.MAX_WORKERS,
+                        help='pages fetched at the same time by each worker process')
+    parser.add_argument('--rps', type=float, default=vnl_ratelimit.RATE,
+                        help='requests per second each worker process sends to a host (0 for no limit)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the on-disk page cache')
+    parser.add_argument('--replay', metavar='DIR',
+                        help='read every page from the archive in DIR instead of the network')
+    args = parser.parse_args()
+    stages = args.stages or STAGES
+    for name in stages:
+        if name not in STAGES:
+            parser.error('unknown stage %r' % name)
+    vnl_http.set_rate_limit(args.rps)
+    if args.no_cache:
+        vnl_http.CACHE = None
+    if args.replay:
+        vnl_http.replay(PageArchive(args.replay))
+
+    if args.command == 'work':
+        run_workers(args.db, args.processes, args.threads)
+    else:
+        queue = WorkQueue(args.db)
+        if args.command == 'enqueue':
+            enqueue(queue, stages, args.out_dir)
+        elif args.command == 'status':
+            print_status(queue)
+        else:
+            if 'bio' in stages:
+                collect_bio(queue, args.out_dir, args.parquet_dir, args.sqlite)
+            if 'matches-2021' in stages:
+                collect_matches(queue, args.out_dir, args.parquet_dir, args.incremental,
+                                args.sqlite)
+        queue.close()
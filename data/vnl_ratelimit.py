@@ -0,0 +1,117 @@
+"""
+Per-host request rate limiting for the shared HTTP client.
+
+Every request takes a token from the bucket of its host before it is sent.
+Buckets refill at the host's current rate; a 429 or 503 answer halves that
+rate and pauses the host for its Retry-After time, and every successful
+answer raises the rate again until it is back at the configured budget.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Requests per second allowed to one host, and how many may go out at once
+# after an idle period
+RATE = 10.0
+BURST = 10
+# Lowest rate the limiter backs off to
+MIN_RATE = 0.5
+# Statuses telling us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+class TokenBucket:
+    """
+    Token bucket of one host with an adaptive refill rate.
+    """
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds the caller has to wait
+        before using it. Tokens can go negative, so waiting callers are
+        served in the order they asked.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.paused_until - now, 0.0)
+
+    def slow_down(self, retry_after=None):
+        """
+        Halve the rate and pause the host for retry_after seconds, or for
+        one request interval if the server did not say.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def speed_up(self):
+        """
+        Move the rate a tenth of the budget back up after a success.
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class RateLimiter:
+    """
+    Token buckets by host, all with the same requests-per-second budget.
+    """
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst, self.min_rate)
+            return self._buckets[host]
+
+    def wait(self, url):
+        """
+        Block until a request to the host of url may be sent; return the
+        seconds waited.
+        """
+        delay = self.bucket(url).reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, url, response):
+        """
+        Adapt the rate of the host of url to the status of its response.
+        Return True if the server asked us to slow down.
+        """
+        if response.status_code in THROTTLE_STATUSES:
+            self.bucket(url).slow_down(retry_after(response))
+            return True
+        self.bucket(url).speed_up()
+        return False
+
+
+def retry_after(response):
+    """
+    Seconds from a Retry-After header, or None if it is missing or a date.
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
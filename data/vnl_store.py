@@ -0,0 +1,249 @@
+"""
+Output backends for the data produced by get_vnl_data.py: the streaming CSV
+sink, the optional Parquet datasets and the optional indexed sqlite store.
+"""
+import json
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+
+
+class CsvSink:
+    """
+    Append-only CSV file that rows are streamed into one batch at a time.
+
+    Every batch is flushed to disk before its key is recorded in a checkpoint
+    file next to the CSV, so a crash loses at most the batch being written.
+    Opening a file that has a checkpoint resumes it: rows written after the
+    last checkpoint are cut off and done lists the keys already stored.
+    A checkpoint that cannot belong to the file (its size is past the end
+    of the file or inside a line) is dropped instead.
+    """
+    def __init__(self, fname, columns, append=False):
+        self.fname = fname
+        self.columns = columns
+        self.checkpoint_fname = fname + '.checkpoint'
+        self.done = []
+        checkpoint = self._read_checkpoint()
+        self._file = open(fname, 'a+', newline='')
+        if checkpoint is not None:
+            self.done = checkpoint['done']
+            self._file.truncate(checkpoint['size'])
+        elif not append:
+            self._file.truncate(0)
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(','.join(columns) + '\n')
+        self.size = self._file.tell()
+
+    def _read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_fname):
+            return None
+        with open(self.checkpoint_fname) as f:
+            checkpoint = json.load(f)
+        size = checkpoint['size']
+        valid = False
+        if os.path.exists(self.fname) and 0 < size <= os.path.getsize(self.fname):
+            # Rows are cut off at line ends only
+            with open(self.fname, 'rb') as f:
+                f.seek(size - 1)
+                valid = f.read(1) == b'\n'
+        if not valid:
+            print('ignoring stale checkpoint %s' % self.checkpoint_fname)
+            os.remove(self.checkpoint_fname)
+            return None
+        return checkpoint
+
+    def append(self, key, df):
+        """
+        Write the rows of df and record key as done.
+        """
+        df.to_csv(self._file, columns=self.columns, header=False, index=False)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.size = self._file.tell()
+        self.done.append(key)
+        with open(self.checkpoint_fname + '.tmp', 'w') as f:
+            json.dump({'done': self.done, 'size': self.size}, f)
+        os.replace(self.checkpoint_fname + '.tmp', self.checkpoint_fname)
+
+    def close(self):
+        """
+        Close the file after a complete run and drop its checkpoint.
+        """
+        self._file.close()
+        if os.path.exists(self.checkpoint_fname):
+            os.remove(self.checkpoint_fname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the checkpoint so the next run can resume
+            self._file.close()
+
+
+def _import_pyarrow():
+    # pyarrow is only needed for the optional Parquet output
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet output needs pyarrow: pip install pyarrow')
+    return pyarrow
+
+
+def arrow_schema(dtypes, partition_cols):
+    """
+    Explicit Arrow schema for columns with the given dtypes plus the
+    partition columns.
+    """
+    pa = _import_pyarrow()
+    types = {'int8': pa.int8(), 'int16': pa.int16(), 'Int16': pa.int16(), 'int32': pa.int32(),
+             'float64': pa.float64(), 'object': pa.string(),
+             'category': pa.dictionary(pa.int8(), pa.string())}
+    fields = [(col, types[dtype]) for col, dtype in dtypes.items()]
+    fields += [(col, pa.int16() if col == 'season' else pa.string()) for col in partition_cols]
+    return pa.schema(fields)
+
+
+def split_matchname(matchname):
+    """
+    Get the gender and stage partition values from schedule match names
+    such as 'Pool 1 - Preliminary Round - Women'.
+    """
+    parts = matchname.str.split(' - ')
+    gender = parts.str[-1].str.strip().str.lower()
+    stage = parts.str[-2].str.strip().str.lower().str.replace(' ', '_')
+    return gender, stage
+
+
+def write_parquet(df, root, dataset, partition_cols, dtypes=None, chunk=0):
+    """
+    Write df into the hive-partitioned Parquet dataset root/dataset.
+    With dtypes the files get an explicit schema, otherwise it is inferred.
+    Files are named after chunk, so several chunks of one run can be written
+    into the same partitions; clear_parquet removes the previous run.
+    """
+    pa = _import_pyarrow()
+    if dtypes is None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    else:
+        schema = arrow_schema(dtypes, partition_cols)
+        # Scraped tables keep their numbers as text; text that is not a
+        # number, such as '' for a missing rate, is stored as missing
+        numeric = {col: pd.to_numeric(df[col], errors='coerce') for col, dtype in dtypes.items()
+                   if dtype not in ('object', 'category')
+                   and not pd.api.types.is_numeric_dtype(df[col])}
+        df = df.assign(**numeric).astype(dtypes)
+        table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    pa.parquet.write_to_dataset(table, os.path.join(root, dataset),
+                                partition_cols=partition_cols,
+                                basename_template='part-%d-{i}.parquet' % chunk,
+                                existing_data_behavior='overwrite_or_ignore')
+
+
+def clear_parquet(root, dataset):
+    """
+    Remove the Parquet dataset root/dataset before it is rewritten.
+    """
+    shutil.rmtree(os.path.join(root, dataset), ignore_errors=True)
+
+
+def load_parquet(root, dataset, columns=None, filters=None):
+    """
+    Load a Parquet dataset written by write_parquet into a DataFrame.
+
+    Only the given columns are read, and filters (pyarrow.parquet style, e.g.
+    [('gender', '=', 'women'), ('nationality', '=', 'SRB')]) are pushed down
+    to skip partitions and row groups that cannot match.
+    """
+    pa = _import_pyarrow()
+    ds = pa.dataset.dataset(os.path.join(root, dataset), format='parquet',
+                            partitioning='hive')
+    expression = pa.parquet.filters_to_expression(filters) if filters else None
+    return ds.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def connect_sqlite(fname):
+    """
+    Open the sqlite store in fname.
+    """
+    conn = sqlite3.connect(fname, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _sqlite_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def write_sqlite(df, fname, table, keys, indexes=()):
+    """
+    Upsert the rows of df into table of the sqlite store in fname: rows whose
+    keys are already stored are updated, the others are added. The table is
+    created on first use with keys as its primary key and an index on every
+    column list of indexes; columns new to the table are added to it.
+    """
+    conn = connect_sqlite(fname)
+    try:
+        with conn:
+            columns = ', '.join('%s %s' % (_quote(col), _sqlite_type(dtype))
+                                for col, dtype in df.dtypes.items())
+            conn.execute('CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s))'
+                         % (_quote(table), columns, ', '.join(map(_quote, keys))))
+            stored = {row[1] for row in conn.execute('PRAGMA table_info(%s)' % _quote(table))}
+            for col, dtype in df.dtypes.items():
+                if col not in stored:
+                    conn.execute('ALTER TABLE %s ADD COLUMN %s %s'
+                                 % (_quote(table), _quote(col), _sqlite_type(dtype)))
+            for cols in indexes:
+                conn.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                             % (_quote('%s_%s' % (table, '_'.join(cols))), _quote(table),
+                                ', '.join(map(_quote, cols))))
+
+            # Plain Python values, None for missing ones
+            values = df.astype(object).where(df.notna(), None)
+            updates = [col for col in df.columns if col not in keys]
+            sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO ' % (
+                _quote(table), ', '.join(map(_quote, df.columns)), ', '.join('?' * len(df.columns)),
+                ', '.join(map(_quote, keys)))
+            if updates:
+                sql += 'UPDATE SET ' + ', '.join('%s = excluded.%s' % (_quote(col), _quote(col))
+                                                 for col in updates)
+            else:
+                sql += 'NOTHING'
+            conn.executemany(sql, values.itertuples(index=False, name=None))
+    finally:
+        conn.close()
+    return len(df)
+
+
+def load_sqlite(fname, table, columns=None, **equals):
+    """
+    Load the rows of table in the sqlite store in fname whose columns have
+    the given values, e.g. load_sqlite(db, 'matches', nationality='SRB').
+    """
+    sql = 'SELECT %s FROM %s' % (', '.join(map(_quote, columns)) if columns else '*',
+                                  _quote(table))
+    if equals:
+        sql += ' WHERE ' + ' AND '.join('%s = ?' % _quote(col) for col in equals)
+    conn = connect_sqlite(fname)
+    try:
+        return pd.read_sql_query(sql, conn, params=list(equals.values()))
+    finally:
+        conn.close()